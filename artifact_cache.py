@@ -0,0 +1,133 @@
+import os
+import pickle
+import tempfile
+
+from collections import Counter
+from hashlib import sha256
+from pathlib import Path
+
+
+def stage_key(*parts) -> str:
+    # every stage is keyed on the key of the stage before it
+    # plus whatever can change that stage's output (code, templates, config)
+    digest = sha256()
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    # content addressed store for the output of each pipeline stage
+    # one pickle per artifact under <directory>/<stage>/<key[:2]>/<key>
+    # reading an artifact bumps its mtime, the oldest get evicted first
+    # once the directory grows past max_bytes
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self._size = None
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.directory / stage / key[:2] / key
+
+    def get(self, stage: str, key: str):
+        path = self._path(stage, key)
+
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses[stage] += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        self.hits[stage] += 1
+        return value
+
+    def put(self, stage: str, key: str, value) -> None:
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError, TypeError):
+            # not worth failing a build over, it just won't be cached
+            return
+
+        path = self._path(stage, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # write to a temp file and rename so other workers never read half a file
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += len(data)
+
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def cached(self, stage: str, key: str, make):
+        if (value := self.get(stage, key)) is not None:
+            return value
+
+        value = make()
+        self.put(stage, key, value)
+        return value
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        for path in self.directory.glob("*/*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # another worker evicted it first
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self) -> None:
+        # trim down to 90% so we aren't evicting on every single put
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+        self._size = size
+
+    def take_stats(self) -> tuple[Counter, Counter]:
+        # hand the counters back (to the main process) and start over
+        stats = (self.hits, self.misses)
+        self.hits = Counter()
+        self.misses = Counter()
+        return stats
+
+
+def format_stats(hits: Counter, misses: Counter) -> str:
+    stages = sorted(set(hits) | set(misses))
+    if not stages:
+        return "cache: unused"
+
+    parts = [f"{stage} {hits[stage]} hit/{misses[stage]} miss" for stage in stages]
+    return "cache: " + ", ".join(parts)
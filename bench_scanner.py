@@ -0,0 +1,77 @@
+import argparse
+import time
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from scanner import HtmlScanner, LxmlScanner
+from tag_token import TokenStream
+
+arg_parser = argparse.ArgumentParser(
+    description="time the scanners on synthetic pages of growing size"
+)
+arg_parser.add_argument(
+    "--sizes",
+    type=int,
+    nargs="+",
+    default=[5_000, 10_000, 20_000, 50_000],
+    help="number of elements in each synthetic page",
+)
+arg_parser.add_argument("--repeat", type=int, default=3)
+arg_parser.add_argument(
+    "--scanner",
+    choices=["bs4", "lxml"],
+    default="bs4",
+    help="bs4 times building the soup as well as scanning it",
+)
+
+
+def synthetic_page(elements: int) -> str:
+    # one very wide list plus a long flat article body, the two shapes
+    # that used to make scanning quadratic
+    items = elements // 2
+    paragraphs = elements - items
+
+    lis = "\n".join(f"<li>item {i}</li>" for i in range(items))
+    ps = "\n".join(f"<p>paragraph {i}</p>" for i in range(paragraphs))
+
+    return (
+        "<html><body><div id='content'>\n"
+        f"<ul>\n{lis}\n</ul>\n"
+        f"<div class='article'>\n{ps}\n</div>\n"
+        "</div></body></html>"
+    )
+
+
+def scan_bs4(html: str) -> TokenStream:
+    soup = BeautifulSoup(html, features="lxml")
+    return HtmlScanner(soup.html).scan_tokens()
+
+
+def scan_lxml(html: str) -> TokenStream:
+    root = etree.fromstring(html, etree.HTMLParser())
+    return LxmlScanner(root).scan_tokens()
+
+
+def time_scan(html: str, repeat: int, scan) -> tuple[float, int]:
+    best = float("inf")
+    tokens = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = scan(html)
+        best = min(best, time.perf_counter() - start)
+
+    return best, len(tokens)
+
+
+if __name__ == "__main__":
+    args = arg_parser.parse_args()
+
+    scan = scan_lxml if args.scanner == "lxml" else scan_bs4
+
+    print(f"{'elements':>10} {'tokens':>10} {'seconds':>10} {'us/element':>12}")
+    for size in args.sizes:
+        seconds, tokens = time_scan(synthetic_page(size), args.repeat, scan)
+        per_element = seconds / size * 1_000_000
+        print(f"{size:>10} {tokens:>10} {seconds:>10.3f} {per_element:>12.2f}")
@@ -0,0 +1,466 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+import traceback
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+
+from artifact_cache import ArtifactCache, format_stats
+from handler_stats import HandlerStats
+from manifest import NOT_FILES, TEMPLATE_DIR, BuildManifest, page_inputs, page_key
+from pipeline import CSS_MODES, SCANNERS, PageProfile, SitePipeline
+from render_godot import format_writes, remove_files, write_files
+
+import generate_home_content
+import generate_main
+import page_content
+
+arg_parser = argparse.ArgumentParser(
+    description="convert every page of the site in one process"
+)
+arg_parser.add_argument("--src", default="src_html", help="source html directory")
+arg_parser.add_argument("--outdir", default="godot_output")
+arg_parser.add_argument(
+    "--pages",
+    default="glas/**/index.html",
+    help="glob (relative to --src) of the article pages",
+)
+arg_parser.add_argument(
+    "--home",
+    default="wizard woes.html",
+    help="homepage (relative to --src), used for the main scene and home content",
+)
+arg_parser.add_argument(
+    "--jobs",
+    "-j",
+    type=int,
+    default=1,
+    help="number of worker processes, 0 uses every core",
+)
+arg_parser.add_argument(
+    "--parse-jobs",
+    type=int,
+    default=1,
+    help="processes for parsing the top level sections of a page in parallel,"
+    " only used with -j 1 (for a handful of huge pages)",
+)
+arg_parser.add_argument(
+    "--async-io",
+    action="store_true",
+    help="read the next pages and write finished ones while others convert,"
+    " for when the output (or source) lives somewhere slow",
+)
+arg_parser.add_argument(
+    "--queue-size",
+    type=int,
+    default=4,
+    help="in --async-io mode, how many pages can wait to be converted"
+    " (and how many converted ones to be written)",
+)
+arg_parser.add_argument(
+    "--force",
+    action="store_true",
+    help="rebuild every page even if the manifest says it is up to date",
+)
+arg_parser.add_argument(
+    "--scanner",
+    choices=SCANNERS,
+    default="bs4",
+    help="bs4 walks a BeautifulSoup tree, lxml scans the lxml tree directly",
+)
+arg_parser.add_argument(
+    "--css",
+    choices=CSS_MODES,
+    default="compiled",
+    help="compiled works styles out from the parsed stylesheets while scanning"
+    " (pages using selectors it can't match still go through css_inline),"
+    " inline runs every page through css_inline first",
+)
+arg_parser.add_argument(
+    "--jinja",
+    action="store_true",
+    help="render scenes through templates/scene.tscn.j2, slower but the output"
+    " can be changed without touching the converter",
+)
+arg_parser.add_argument(
+    "--cache-dir",
+    default=".build_cache",
+    help="where to keep the per-stage artifact cache",
+)
+arg_parser.add_argument(
+    "--cache-size",
+    type=int,
+    default=512,
+    help="size limit of the artifact cache in MB",
+)
+arg_parser.add_argument(
+    "--no-cache", action="store_true", help="don't use the artifact cache"
+)
+arg_parser.add_argument(
+    "--handler-stats",
+    action="store_true",
+    help="print how often each scanner/parser handler ran and how long it took",
+)
+arg_parser.add_argument(
+    "--watch",
+    action="store_true",
+    help="stay running and rebuild pages whenever their inputs change",
+)
+arg_parser.add_argument(
+    "--interval",
+    type=float,
+    default=0.5,
+    help="seconds between polls in --watch mode",
+)
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in [
+        generate_main.PROFILE,
+        generate_home_content.PROFILE,
+        page_content.PROFILE,
+    ]
+}
+
+
+def collect_jobs(src_dir: Path, pages_glob: str, home: str) -> list:
+    jobs = []
+
+    home_src = src_dir / home
+    if home and home_src.is_file():
+        jobs.append((PROFILES["main"], home_src))
+        jobs.append((PROFILES["home"], home_src))
+
+    for page in sorted(src_dir.glob(pages_glob)):
+        jobs.append((PROFILES["page"], page))
+
+    return jobs
+
+
+def largest_first(jobs: list[tuple[PageProfile, Path]]) -> list:
+    # start the big pages first so one of them doesn't end up
+    # running alone on a single core at the end of the build
+    return sorted(jobs, key=lambda job: job[1].stat().st_size, reverse=True)
+
+
+def make_pipeline(output_dir, cache_config, options: dict) -> SitePipeline:
+    cache = ArtifactCache(*cache_config) if cache_config else None
+    return SitePipeline(output_dir, cache=cache, **options)
+
+
+def take_stats(pipeline: SitePipeline) -> tuple:
+    stats = pipeline.cache.take_stats() if pipeline.cache else None
+    handler_stats = pipeline.stats.take() if pipeline.stats else None
+    return stats, handler_stats
+
+
+def build_one(pipeline: SitePipeline, profile: PageProfile, src: Path) -> tuple:
+    try:
+        outputs = pipeline.build_page(profile, src)
+    except Exception:
+        # one broken page shouldn't stop the rest of the site
+        print(f"failed to convert {src} ({profile.name})", file=sys.stderr)
+        traceback.print_exc()
+        outputs = None
+
+    return outputs, *take_stats(pipeline)
+
+
+def render_one(pipeline: SitePipeline, profile_name: str, src: Path, raw) -> tuple:
+    # build_one without the writing, that's left to whoever asked
+    profile = PROFILES[profile_name]
+    try:
+        rendered = pipeline.render_page(profile, src, raw)
+    except Exception:
+        print(f"failed to convert {src} ({profile.name})", file=sys.stderr)
+        traceback.print_exc()
+        rendered = None
+
+    return rendered, *take_stats(pipeline)
+
+
+def write_page(output_dir, profile: PageProfile, src: Path, rendered: dict) -> dict:
+    out_dir, _ = profile.output(src)
+    return write_files(Path(output_dir) / out_dir, rendered)
+
+
+def build_site(pipeline: SitePipeline, jobs: list[tuple[PageProfile, Path]]):
+    for profile, src in jobs:
+        yield profile, src, *build_one(pipeline, profile, src)
+
+
+# every worker process keeps its own warm pipeline
+# (inliner, jinja env, imports) for all the pages it gets handed
+_worker_pipeline: SitePipeline = None
+
+
+def _init_worker(output_dir, cache_config, options: dict) -> None:
+    global _worker_pipeline
+    _worker_pipeline = make_pipeline(output_dir, cache_config, options)
+
+
+def _build_in_worker(profile_name: str, src: Path) -> tuple:
+    return build_one(_worker_pipeline, PROFILES[profile_name], src)
+
+
+def make_executor(output_dir, cache_config, options, workers) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(output_dir, cache_config, options),
+    )
+
+
+def _render_in_worker(profile_name: str, src: Path, raw: bytes) -> tuple:
+    return render_one(_worker_pipeline, profile_name, src, raw)
+
+
+def build_site_parallel(executor, jobs: list[tuple[PageProfile, Path]]):
+    futures = {
+        executor.submit(_build_in_worker, profile.name, src): (profile, src)
+        for profile, src in largest_first(jobs)
+    }
+
+    for future in as_completed(futures):
+        profile, src = futures[future]
+        yield profile, src, *future.result()
+
+
+async def build_site_async(
+    executor, render, jobs: list, output_dir, converters: int, queue_size: int
+) -> list:
+    # read -> convert -> write with bounded queues in between, so reading the
+    # next pages and writing out finished ones happens while pages convert
+    # and no more than queue_size pages wait on either side of the converters
+    loop = asyncio.get_running_loop()
+    to_convert = asyncio.Queue(queue_size)
+    to_write = asyncio.Queue(queue_size)
+    results = []
+
+    async def read():
+        for profile, src in jobs:
+            try:
+                raw = await asyncio.to_thread(src.read_bytes)
+            except OSError:
+                # the converter runs into it again and reports the page
+                raw = None
+            await to_convert.put((profile, src, raw))
+
+        for _ in range(converters):
+            await to_convert.put(None)
+
+    async def convert():
+        while (job := await to_convert.get()) is not None:
+            profile, src, raw = job
+            done = await loop.run_in_executor(executor, render, profile.name, src, raw)
+            await to_write.put((profile, src, *done))
+
+    async def write():
+        while (job := await to_write.get()) is not None:
+            profile, src, rendered, stats, handler_stats = job
+            outputs = None
+            if rendered is not None:
+                try:
+                    outputs = await asyncio.to_thread(
+                        write_page, output_dir, profile, src, rendered
+                    )
+                except OSError:
+                    print(f"failed to write {src} ({profile.name})", file=sys.stderr)
+                    traceback.print_exc()
+
+            results.append((profile, src, outputs, stats, handler_stats))
+
+    writers = [asyncio.create_task(write()) for _ in range(queue_size)]
+    await asyncio.gather(read(), *(convert() for _ in range(converters)))
+
+    for _ in writers:
+        await to_write.put(None)
+    await asyncio.gather(*writers)
+
+    return results
+
+
+def run_async(args, jobs: list, pipeline=None, executor=None) -> list:
+    if executor:
+        converters = args.jobs or os.cpu_count()
+        return asyncio.run(
+            build_site_async(
+                executor,
+                _render_in_worker,
+                largest_first(jobs),
+                args.outdir,
+                converters,
+                args.queue_size,
+            )
+        )
+
+    # one pipeline isn't safe to share, so one thread converts with it
+    with ThreadPoolExecutor(1) as thread:
+        render = partial(render_one, pipeline)
+        return asyncio.run(
+            build_site_async(thread, render, jobs, args.outdir, 1, args.queue_size)
+        )
+
+
+def output_options(args) -> dict:
+    # the options that change what a page turns into
+    return {"scanner": args.scanner, "css": args.css, "jinja": args.jinja}
+
+
+def stale_jobs(manifest: BuildManifest, jobs: list, options: dict, force=False):
+    stale = []
+    inputs = {}
+
+    for profile, src in jobs:
+        key = page_key(profile.name, src)
+        inputs[key] = page_inputs(src, options)
+
+        if force or not manifest.is_fresh(key, inputs[key]):
+            stale.append((profile, src))
+
+    return stale, inputs
+
+
+def run_build(args, manifest: BuildManifest, pipeline=None, executor=None) -> int:
+    jobs = collect_jobs(Path(args.src), args.pages, args.home)
+    stale, inputs = stale_jobs(
+        manifest, jobs, output_options(args), force=args.force
+    )
+
+    if args.async_io:
+        results = run_async(args, stale, pipeline, executor)
+    elif executor:
+        results = build_site_parallel(executor, stale)
+    else:
+        results = build_site(pipeline, stale)
+
+    failed = 0
+    writes = {}
+    hits, misses = Counter(), Counter()
+    handlers = HandlerStats()
+    # outputs of deleted pages, and ones pages stopped making
+    leftovers = manifest.drop_missing()
+    for profile, src, outputs, stats, handler_stats in results:
+        if stats:
+            hits.update(stats[0])
+            misses.update(stats[1])
+        if handler_stats:
+            handlers.update(handler_stats)
+
+        if outputs is None:
+            failed += 1
+            continue
+
+        writes.update(outputs)
+
+        key = page_key(profile.name, src)
+        leftovers.extend(manifest.record(key, inputs[key], list(outputs)))
+
+    removed = remove_files(manifest.unowned(leftovers), args.outdir)
+    manifest.save()
+
+    print(
+        f"converted {len(stale) - failed}/{len(stale)} pages,"
+        f" {len(jobs) - len(stale)} up to date"
+    )
+    print(format_writes(writes, removed))
+    if not args.no_cache:
+        print(format_stats(hits, misses))
+    if args.handler_stats:
+        print(handlers.report())
+
+    return failed
+
+
+def watched_files(args, manifest: BuildManifest) -> dict[Path, tuple]:
+    # the source tree and templates, plus anything a page said it depends on
+    # (stylesheets can live outside of --src)
+    paths = {p for p in Path(args.src).rglob("*") if p.is_file()}
+    paths.update(TEMPLATE_DIR.glob("*.j2"))
+
+    for record in manifest.pages.values():
+        paths.update(Path(p) for p in record.inputs if p not in NOT_FILES)
+
+    stats = {}
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        stats[path] = (stat.st_mtime_ns, stat.st_size)
+
+    return stats
+
+
+def watch(args, manifest: BuildManifest, pipeline=None, executor=None) -> None:
+    # the manifest hashes decide what actually gets rebuilt,
+    # polling mtimes is just the cheap way of noticing something happened
+    # changes to the converter itself need a restart
+    seen = watched_files(args, manifest)
+    print(f"watching {len(seen)} files, ctrl+c to stop")
+
+    try:
+        while True:
+            time.sleep(args.interval)
+
+            current = watched_files(args, manifest)
+            if current == seen:
+                continue
+
+            # what changed while the build ran gets picked up next time round
+            seen = current
+            try:
+                run_build(args, manifest, pipeline, executor)
+            except Exception:
+                # a half saved file shouldn't end the watch, the next save
+                # will most likely fix it
+                print("build failed, still watching", file=sys.stderr)
+                traceback.print_exc()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(args) -> int:
+    workers = args.jobs or os.cpu_count()
+    manifest = BuildManifest.load(args.outdir)
+
+    cache_config = None
+    if not args.no_cache:
+        cache_config = (args.cache_dir, args.cache_size * 1024 * 1024)
+
+    options = output_options(args)
+    options["handler_stats"] = args.handler_stats
+
+    if workers > 1:
+        executor = make_executor(args.outdir, cache_config, options, workers)
+        pipeline = None
+    else:
+        executor = None
+        options["parse_jobs"] = args.parse_jobs
+        pipeline = make_pipeline(args.outdir, cache_config, options)
+
+    try:
+        failed = run_build(args, manifest, pipeline, executor)
+
+        if args.watch:
+            # whatever is forced was just built, after that only rebuild changes
+            args.force = False
+            watch(args, manifest, pipeline, executor)
+    finally:
+        if executor:
+            executor.shutdown()
+        if pipeline:
+            pipeline.close()
+
+    return failed
+
+
+if __name__ == "__main__":
+    args = arg_parser.parse_args()
+    sys.exit(1 if main(args) else 0)
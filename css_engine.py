@@ -0,0 +1,643 @@
+import re
+import sys
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+
+from bs4 import Tag
+
+from manifest import resolve_stylesheet
+from tag_token import EMPTY_ATTRS, FrozenAttrs, parse_style
+
+SUPPORTED_PSEUDO_CLASSES = {"first-child", "last-child", "only-child"}
+# these never match when styles get baked in ahead of time, same as css_inline
+DYNAMIC_PSEUDO_CLASSES = {
+    "hover",
+    "active",
+    "focus",
+    "focus-within",
+    "focus-visible",
+    "visited",
+    "target",
+}
+
+COMPOUND = re.compile(
+    r"""
+    (?P<tag>\*|[a-zA-Z][-\w]*)?
+    (?P<rest>(?:
+        [#.][-\w]+
+        | \[[^\]]*\]
+        | :[-\w]+
+    )*)
+    """,
+    re.VERBOSE,
+)
+SIMPLE = re.compile(r"([#.])([-\w]+)|\[([^\]]*)\]|:([-\w]+)")
+ATTRIBUTE = re.compile(
+    r"""\s*([-\w]+)\s*(?:([~|^$*]?=)\s*(?:"([^"]*)"|'([^']*)'|([^\s\]]+))\s*)?$"""
+)
+COMBINATOR = re.compile(r"\s*([>+~])\s*|\s+")
+COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+# commas that aren't inside an attribute selector
+SELECTOR_SEPARATOR = re.compile(r",(?![^\[]*\])")
+IMPORTANT = re.compile(r"\s*!\s*important\s*$", re.IGNORECASE)
+
+
+class UnsupportedSelector(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Compound:
+    # one element's worth of selector, e.g. div.note#intro[lang]:first-child
+    tag: str = None
+    id: str = None
+    classes: frozenset = frozenset()
+    attributes: tuple = ()
+    pseudo_classes: tuple = ()
+
+    def matches(self, el, tree) -> bool:
+        if self.tag and tree.name(el) != self.tag:
+            return False
+        if self.id and tree.attribute(el, "id") != self.id:
+            return False
+        if self.classes and not self.classes <= tree.classes(el):
+            return False
+
+        for name, operator, expected in self.attributes:
+            if not match_attribute(tree.attribute(el, name), operator, expected):
+                return False
+
+        for pseudo in self.pseudo_classes:
+            match pseudo:
+                case "first-child":
+                    if tree.previous_sibling(el) is not None:
+                        return False
+                case "last-child":
+                    if tree.next_sibling(el) is not None:
+                        return False
+                case "only-child":
+                    if tree.previous_sibling(el) is not None:
+                        return False
+                    if tree.next_sibling(el) is not None:
+                        return False
+                case _:
+                    return False
+
+        return True
+
+
+def match_attribute(value, operator, expected) -> bool:
+    if value is None:
+        return False
+
+    match operator:
+        case None:
+            return True
+        case "=":
+            return value == expected
+        case "~=":
+            return expected in value.split()
+        case "|=":
+            return value == expected or value.startswith(expected + "-")
+        case "^=":
+            return bool(expected) and value.startswith(expected)
+        case "$=":
+            return bool(expected) and value.endswith(expected)
+        case "*=":
+            return bool(expected) and expected in value
+
+    return False
+
+
+def parse_compound(text: str) -> Compound:
+    found = COMPOUND.fullmatch(text)
+    if not found or not text:
+        raise UnsupportedSelector(text)
+
+    tag = found.group("tag")
+    element_id = None
+    classes = set()
+    attributes = []
+    pseudo_classes = []
+
+    for prefix, name, attribute, pseudo in SIMPLE.findall(found.group("rest")):
+        if prefix == "#":
+            element_id = name
+        elif prefix == ".":
+            classes.add(name)
+        elif pseudo:
+            pseudo = pseudo.lower()
+            if pseudo not in SUPPORTED_PSEUDO_CLASSES | DYNAMIC_PSEUDO_CLASSES:
+                raise UnsupportedSelector(text)
+            pseudo_classes.append(pseudo)
+        else:
+            parsed = ATTRIBUTE.match(attribute)
+            if not parsed:
+                raise UnsupportedSelector(text)
+            name, operator, *quoted = parsed.groups()
+            expected = next((q for q in quoted if q is not None), None)
+            attributes.append((name.lower(), operator, expected))
+
+    return Compound(
+        tag=None if tag in (None, "*") else tag.lower(),
+        id=element_id,
+        classes=frozenset(classes),
+        attributes=tuple(attributes),
+        pseudo_classes=tuple(pseudo_classes),
+    )
+
+
+def parse_selector(text: str) -> tuple:
+    # "div > p.note" -> ((p.note, ">"), (div, None)), rightmost compound first
+    # along with the combinator that joins it to the compound on its left
+    if "::" in text or "(" in text or "," in text or not text.strip():
+        raise UnsupportedSelector(text)
+
+    compounds = []
+    combinators = []
+    position = 0
+    text = text.strip()
+
+    while position < len(text):
+        if combinator := COMBINATOR.match(text, position):
+            if not compounds:
+                raise UnsupportedSelector(text)
+            combinators.append(combinator.group(1) or " ")
+            position = combinator.end()
+            continue
+
+        end = position
+        while end < len(text) and not COMBINATOR.match(text, end):
+            if text[end] == "[":
+                end = text.index("]", end)
+            end += 1
+
+        compounds.append(parse_compound(text[position:end]))
+        position = end
+
+    if len(combinators) != len(compounds) - 1:
+        raise UnsupportedSelector(text)
+
+    return tuple(zip(reversed(compounds), [*reversed(combinators), None]))
+
+
+def match_parts(parts: tuple, index: int, el, tree) -> bool:
+    # parts[index - 1] matched el, see if the rest of the selector
+    # (to the left) matches something around it
+    if index == len(parts):
+        return True
+
+    _, combinator = parts[index - 1]
+    compound, _ = parts[index]
+
+    match combinator:
+        case ">":
+            parent = tree.parent(el)
+            return (
+                parent is not None
+                and compound.matches(parent, tree)
+                and match_parts(parts, index + 1, parent, tree)
+            )
+        case "+":
+            sibling = tree.previous_sibling(el)
+            return (
+                sibling is not None
+                and compound.matches(sibling, tree)
+                and match_parts(parts, index + 1, sibling, tree)
+            )
+        case "~":
+            step = tree.previous_sibling
+        case _:
+            step = tree.parent
+
+    candidate = step(el)
+    while candidate is not None:
+        if compound.matches(candidate, tree) and match_parts(
+            parts, index + 1, candidate, tree
+        ):
+            return True
+        candidate = step(candidate)
+
+    return False
+
+
+@dataclass
+class StyleRule:
+    parts: tuple
+    specificity: tuple
+    # position in the sheet, later rules win ties
+    order: int
+    declarations: tuple
+    # nothing but a tag/#id/.class, so it matches on the candidates key alone
+    local: bool = field(init=False)
+
+    def __post_init__(self):
+        compound, _ = self.parts[0]
+        self.local = len(self.parts) == 1 and not (
+            compound.attributes or compound.pseudo_classes
+        )
+
+    def matches(self, el, tree) -> bool:
+        compound, _ = self.parts[0]
+        return compound.matches(el, tree) and match_parts(self.parts, 1, el, tree)
+
+
+@dataclass
+class Stylesheet:
+    # a parsed stylesheet with its rules indexed by the rightmost compound's
+    # id, else one of its classes, else its tag, so an element only gets
+    # checked against rules that could possibly match it
+    by_id: dict = field(default_factory=dict)
+    by_class: dict = field(default_factory=dict)
+    by_tag: dict = field(default_factory=dict)
+    universal: list = field(default_factory=list)
+    # sibling combinators and :*-child look outside an element's ancestors
+    uses_siblings: bool = False
+    unsupported: list = field(default_factory=list)
+    # (tag, id, classes) -> the rules to check, most elements share a few keys
+    _candidates: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def parse(cls, css: str) -> "Stylesheet":
+        sheet = cls()
+        order = 0
+
+        for prelude, block in css_blocks(css):
+            # @media, @font-face, @import etc don't apply to inlined styles
+            if block is None or prelude.startswith("@"):
+                continue
+
+            declarations = parse_declarations(block)
+
+            for selector in SELECTOR_SEPARATOR.split(prelude):
+                order += 1
+                try:
+                    parts = parse_selector(selector)
+                except UnsupportedSelector:
+                    sheet.unsupported.append(selector.strip())
+                    continue
+
+                if any(dynamic_pseudo(compound) for compound, _ in parts):
+                    continue
+
+                sheet.add(StyleRule(parts, specificity(parts), order, declarations))
+
+        return sheet
+
+    def add(self, rule: StyleRule) -> None:
+        compound, _ = rule.parts[0]
+
+        if compound.id:
+            self.by_id.setdefault(compound.id, []).append(rule)
+        elif compound.classes:
+            self.by_class.setdefault(min(compound.classes), []).append(rule)
+        elif compound.tag:
+            self.by_tag.setdefault(compound.tag, []).append(rule)
+        else:
+            self.universal.append(rule)
+
+        for part, combinator in rule.parts:
+            if combinator in ("+", "~") or part.pseudo_classes:
+                self.uses_siblings = True
+
+    def candidates(self, key: tuple) -> tuple:
+        if (rules := self._candidates.get(key)) is not None:
+            return rules
+
+        name, element_id, classes = key
+        rules = {}
+        for found in [
+            self.by_id.get(element_id, ()),
+            *(self.by_class.get(class_name, ()) for class_name in classes),
+            self.by_tag.get(name, ()),
+            self.universal,
+        ]:
+            rules.update((rule.order, rule) for rule in found)
+
+        # in source order, so matches come out in cascade order
+        rules = self._candidates[key] = tuple(rules[o] for o in sorted(rules))
+        return rules
+
+
+def css_blocks(css: str):
+    # top level (prelude, block) pairs, block is None for at-rules like
+    # @import that end in a ";", nested blocks (@media) come back as one block
+    css = COMMENT.sub("", css)
+    start = 0
+    depth = 0
+    quote = None
+
+    for i, char in enumerate(css):
+        if quote:
+            if char == quote and css[i - 1] != "\\":
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "{":
+            if depth == 0:
+                block_start = i
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                yield css[start:block_start].strip(), css[block_start + 1 : i]
+                start = i + 1
+        elif char == ";" and depth == 0:
+            yield css[start:i].strip(), None
+            start = i + 1
+
+
+def parse_declarations(block: str) -> tuple:
+    # like tag_token.parse_style but keeping repeats and !important apart,
+    # values stay exactly as written, same as css_inline copies them over
+    declarations = []
+    for declaration in block.split(";"):
+        name, colon, value = declaration.partition(":")
+        name = name.strip().lower()
+
+        important = IMPORTANT.search(value)
+        if important:
+            value = value[: important.start()]
+        value = value.strip()
+
+        if colon and name and value:
+            declarations.append((name, value, bool(important)))
+
+    return tuple(declarations)
+
+
+def specificity(parts: tuple) -> tuple:
+    ids = classes = tags = 0
+    for compound, _ in parts:
+        ids += compound.id is not None
+        classes += len(compound.classes) + len(compound.attributes)
+        classes += len(compound.pseudo_classes)
+        tags += compound.tag is not None
+
+    return ids, classes, tags
+
+
+def dynamic_pseudo(compound: Compound) -> bool:
+    return any(p in DYNAMIC_PSEUDO_CLASSES for p in compound.pseudo_classes)
+
+
+class PageStyles:
+    # the computed style attribute of every element of one page:
+    # the matching rules of every sheet in cascade order, then its own style=""
+    # works on bs4 or lxml trees through the tree adapter
+    def __init__(self, sheets: list[Stylesheet], tree) -> None:
+        self.sheets = sheets
+        self.tree = tree
+        self.uses_siblings = any(sheet.uses_siblings for sheet in sheets)
+        # styles worked out ahead of time by warm()
+        self._styles = {}
+        self._shared = {}
+        # tree.key(el) -> (rules of every sheet to check, are they all local)
+        self._candidates = {}
+        # (tree.key(el), style attribute) -> style, see compute
+        self._by_key = {}
+
+    @property
+    def unsupported(self) -> bool:
+        # selectors we can't match, the page's styles would come out wrong
+        return any(sheet.unsupported for sheet in self.sheets)
+
+    def style_of(self, el) -> FrozenAttrs:
+        if self._styles:
+            return self._styles[id(el)][1]
+        return self.compute(el)
+
+    def warm(self, root) -> None:
+        # work everything out now, before the tree gets elements pulled out,
+        # holding on to the elements so their ids stay theirs
+        self._styles = {
+            id(el): (el, self.compute(el)) for el in self.tree.descendants(root)
+        }
+
+    def compute(self, el) -> FrozenAttrs:
+        key = (self.tree.key(el), self.tree.attribute(el, "style"))
+        if (style := self._by_key.get(key)) is not None:
+            return style
+
+        rules, local = self.candidates(el)
+        matched = [rule for rule in rules if rule.matches(el, self.tree)]
+        style = self.cascade(matched, key[1])
+
+        # with only plain tag/#id/.class rules in play every element with the
+        # same key and style attribute comes out the same, whatever is around it
+        if local:
+            self._by_key[key] = style
+
+        return style
+
+    def candidates(self, el) -> tuple[list, bool]:
+        key = self.tree.key(el)
+        if (found := self._candidates.get(key)) is None:
+            tree = self.tree
+            selector_key = (
+                tree.name(el),
+                tree.attribute(el, "id"),
+                frozenset(tree.classes(el)),
+            )
+            rules = [
+                rule for sheet in self.sheets for rule in sheet.candidates(selector_key)
+            ]
+            found = self._candidates[key] = (rules, all(r.local for r in rules))
+
+        return found
+
+    def cascade(self, matched: list[StyleRule], attribute: str) -> FrozenAttrs:
+        if not matched:
+            return parse_style(attribute)
+
+        # same cascade as css_inline: rules in source order, a declaration
+        # wins over an earlier one with the same or lower (importance,
+        # specificity), then ordered by the winner's specificity
+        declared = {}
+        for rule in matched:
+            for name, value, is_important in rule.declarations:
+                rank = (is_important, rule.specificity)
+                if (current := declared.get(name)) is None or rank >= current[0]:
+                    declared[name] = (rank, value)
+
+        by_specificity = sorted(declared.items(), key=lambda d: d[1][0][1])
+
+        # the style attribute beats anything but !important,
+        # and it keeps its own order after the stylesheet declarations.
+        # values come out without their !important, it's been applied
+        inline = parse_declarations(attribute) if attribute else ()
+        inline_names = {name for name, _, _ in inline}
+        style = {
+            name: value
+            for name, (_, value) in by_specificity
+            if name not in inline_names
+        }
+        for name, value, is_important in inline:
+            if name in declared and declared[name][0][0] and not is_important:
+                value = declared[name][1]
+            style[name] = value
+
+        return self.share(style)
+
+    def share(self, style: dict) -> FrozenAttrs:
+        # identical computed styles end up as the one object
+        key = tuple(style.items())
+        if (shared := self._shared.get(key)) is None:
+            shared = self._shared[key] = FrozenAttrs(style) if style else EMPTY_ATTRS
+        return shared
+
+
+@lru_cache(maxsize=64)
+def parse_stylesheet(css: str, origin="<style>") -> Stylesheet:
+    # every page links the same site css, so this only really runs once
+    # per process, the same goes for identical <style> blocks
+    sheet = Stylesheet.parse(css)
+
+    if sheet.unsupported:
+        print(
+            f"{origin}: unsupported selectors {', '.join(sheet.unsupported)},"
+            " pages using it go through css_inline instead",
+            file=sys.stderr,
+        )
+
+    return sheet
+
+
+def load_stylesheet(path: Path) -> Stylesheet:
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_stylesheet(f.read(), path.as_posix())
+
+
+def page_styles(tree, document, src: Path) -> tuple[PageStyles, list]:
+    # the sheets of a page in the order css_inline applies them, every
+    # <style> and then every linked sheet, along with the elements they came from
+    styles = []
+    links = []
+    elements = []
+
+    for el in tree.find_all(document, ("link", "style")):
+        if tree.name(el) == "style":
+            styles.append(parse_stylesheet(tree.text(el)))
+        elif "stylesheet" in (tree.attribute(el, "rel") or "").split():
+            href = tree.attribute(el, "href")
+            # missing and remote sheets get skipped, same as the manifest does
+            if href and (path := resolve_stylesheet(src, href)):
+                links.append(load_stylesheet(path))
+        else:
+            continue
+
+        elements.append(el)
+
+    return PageStyles(styles + links, tree), elements
+
+
+class Bs4Tree:
+    # what selector matching needs to know about a BeautifulSoup tree
+    @staticmethod
+    def name(el) -> str:
+        return el.name
+
+    @staticmethod
+    def attribute(el, name: str):
+        value = el.get(name)
+        if isinstance(value, list):
+            return " ".join(value)
+        return value
+
+    @staticmethod
+    def classes(el) -> set:
+        return set(el.get("class") or ())
+
+    @staticmethod
+    def key(el) -> tuple:
+        # what the rules that could match el depend on, cheap to make
+        return el.name, el.get("id"), tuple(el.get("class") or ())
+
+    @staticmethod
+    def parent(el):
+        parent = el.parent
+        if parent is None or parent.parent is None:
+            # the BeautifulSoup object itself isn't an element
+            return None
+        return parent
+
+    @staticmethod
+    def previous_sibling(el):
+        for sibling in el.previous_siblings:
+            if isinstance(sibling, Tag):
+                return sibling
+        return None
+
+    @staticmethod
+    def next_sibling(el):
+        for sibling in el.next_siblings:
+            if isinstance(sibling, Tag):
+                return sibling
+        return None
+
+    @staticmethod
+    def descendants(root):
+        yield root
+        for el in root.descendants:
+            if isinstance(el, Tag):
+                yield el
+
+    @staticmethod
+    def find_all(root, names: tuple):
+        return root.find_all(names)
+
+    @staticmethod
+    def text(el) -> str:
+        return el.get_text()
+
+
+class LxmlTree:
+    @staticmethod
+    def name(el) -> str:
+        return el.tag
+
+    @staticmethod
+    def attribute(el, name: str):
+        return el.get(name)
+
+    @staticmethod
+    def classes(el) -> set:
+        return set((el.get("class") or "").split())
+
+    @staticmethod
+    def key(el) -> tuple:
+        return el.tag, el.get("id"), el.get("class")
+
+    @staticmethod
+    def parent(el):
+        return el.getparent()
+
+    @staticmethod
+    def previous_sibling(el):
+        sibling = el.getprevious()
+        while sibling is not None and not isinstance(sibling.tag, str):
+            sibling = sibling.getprevious()
+        return sibling
+
+    @staticmethod
+    def next_sibling(el):
+        sibling = el.getnext()
+        while sibling is not None and not isinstance(sibling.tag, str):
+            sibling = sibling.getnext()
+        return sibling
+
+    @staticmethod
+    def descendants(root):
+        for el in root.iter():
+            if isinstance(el.tag, str):
+                yield el
+
+    @staticmethod
+    def find_all(root, names: tuple):
+        return root.iter(*names)
+
+    @staticmethod
+    def text(el) -> str:
+        return el.text or ""
@@ -0,0 +1,77 @@
+import re
+
+from functools import lru_cache
+
+# what 1rem is, and the font size of anything nobody set one for
+ROOT_FONT_SIZE = 16
+
+# a number and whatever unit is stuck to it: "12px", "1.5em", ".5rem", "-2", "50%"
+LENGTH = re.compile(r"([+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:e[+-]?\d+)?)([a-z%]*)", re.I)
+
+
+@lru_cache(maxsize=1024)
+def parse_length(value: str) -> tuple[float, str]:
+    # "1.5EM" -> (1.5, "em"), None for anything that isn't a number and a unit
+    if found := LENGTH.fullmatch(value.strip()):
+        return float(found[1]), found[2].lower()
+    return None
+
+
+# this may be used in other css values than just padding
+@lru_cache(maxsize=4096)
+def convert_css_value_to_godot(value: str, font_size=ROOT_FONT_SIZE) -> tuple:
+    # ("int", n) for px we can work out now, ("float", n) for a % as a fraction,
+    # ("script", code) for what depends on the viewport at runtime,
+    # ("str", value) for the rest
+    # em is relative to font_size, the computed font size of the element
+    if value.strip().lower() == "auto":
+        return ("str", "auto value")
+
+    if (length := parse_length(value)) is None:
+        return ("str", value)
+
+    number, unit = length
+    match unit:
+        case "px" | "":
+            return ("int", round(number))
+        case "%":
+            return ("float", number * 0.01)
+        case "vh":
+            calc = number * 0.01
+            return ("script", f"{calc} * get_viewport().get_visible_rect().size.y")
+        case "vw":
+            calc = number * 0.01
+            return ("script", f"{calc} * get_viewport().get_visible_rect().size.x")
+        case "rem":
+            # rem is relative to size of root element font
+            return ("int", round(number * ROOT_FONT_SIZE))
+        case "em":
+            return ("int", round(number * font_size))
+        case "pt":
+            return ("int", round(number * 4 / 3))
+
+    return ("str", value)
+
+
+@lru_cache(maxsize=1024)
+def resolve_font_size(value: str, parent_size: float) -> float:
+    # the computed font size in px of an element with font-size: value
+    # inside of one that's parent_size px, em and % go off the parent's
+    if not value or (length := parse_length(value)) is None:
+        # keywords (small, larger, ...) aren't handled, keep the parent's
+        return parent_size
+
+    number, unit = length
+    match unit:
+        case "px" | "":
+            return number
+        case "em":
+            return number * parent_size
+        case "%":
+            return number * parent_size * 0.01
+        case "rem":
+            return number * ROOT_FONT_SIZE
+        case "pt":
+            return number * 4 / 3
+
+    return parent_size
@@ -1,37 +1,27 @@
 import argparse
 
 from pathlib import Path
-from bs4 import BeautifulSoup
-import css_inline
 
-from scanner import HtmlScanner
-
-# need a better way of doing collect_ext_resources, collect_node_scripts
-from node_parser import Parser
-from render_godot import SceneWriter
-
-from godot import (
-    NodeGodot,
-    SceneGodot,
-)
+from pipeline import PageProfile, SitePipeline
+from render_godot import format_writes
 
 arg_parser = argparse.ArgumentParser(description="make a scene from the <content>")
 arg_parser.add_argument("--src", help="source html")
 arg_parser.add_argument("--outfile")
-arg_parser.add_argument("--outdir")
+arg_parser.add_argument("--outdir", default="godot_output")
 
 
-def main(args):
-    test_doc = Path(args.src)
-    inliner = css_inline.CSSInliner()
+def home_output(src: Path) -> tuple[Path, str]:
+    return Path("home"), "home"
 
-    with open(test_doc, "r", encoding="utf-8") as f:
-        inlined = inliner.inline(f.read())
-
-    soup = BeautifulSoup(inlined, features="lxml")
 
+PROFILE = PageProfile(
+    name="home",
+    root_name="content",
+    root_type="VBoxContainer",
+    output=home_output,
     # mostly works
-    root_properties = {
+    root_properties={
         "size_flags_horizontal": 3,
         "size_flags_vertical": 3,
         # "anchors_preset": 15,
@@ -39,37 +29,19 @@ def main(args):
         # "anchor_bottom": 1.0,
         # "horizontal_scroll_mode": 0,
         # "vertical_scroll_mode": 2,
-    }
-
-    # remove the head tag
-    soup.html.head.extract()
-
-    # remove the navbar (for now)
-    soup.html.body.nav.extract()
-
-    # remove the footer (for now)
-    soup.html.body.footer.extract()
-
-    root_node = NodeGodot("content", "VBoxContainer", properties=root_properties)
-
-    scanner = HtmlScanner(soup.html.body.find(id="main"))
-    tokens = scanner.scan_tokens()
-
-    parser = Parser(tokens, root_node=root_node)
-    nodes = parser.parse()
-
-    for child in nodes:
-        root_node.add_child(child)
+    },
+    # remove the head tag, the navbar and the footer (for now)
+    strip=("head", "nav", "footer"),
+    scan_root="main",
+)
 
-    scene = SceneGodot(root_node)
 
-    outfile = f"home"
-    base_dir = Path(f"godot_output\{outfile}")
+def main(args):
+    pipeline = SitePipeline(args.outdir)
+    outputs = pipeline.build_page(PROFILE, Path(args.src))
+    print(format_writes(outputs))
 
-    writer = SceneWriter(scene, base_dir, outfile)
-    writer.write_out_scene()
-    writer.write_out_resources()
 
 if __name__ == "__main__":
     args = arg_parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
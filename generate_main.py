@@ -1,17 +1,9 @@
 from pathlib import Path
-from bs4 import BeautifulSoup
-import css_inline
 
-from scanner import HtmlScanner
+from pipeline import PageProfile, SitePipeline
+from render_godot import format_writes
 
-# need a better way of doing collect_ext_resources, collect_node_scripts
-from node_parser import (
-    Parser,
-)
-
-from render_godot import SceneWriter
-
-from godot import NodeGodot, SceneGodot, ScriptFunction, GDScriptResource
+from godot import NodeGodot, ScriptFunction, GDScriptResource
 
 
 def setup_ready_script():
@@ -42,17 +34,25 @@ def setup_ready_script():
     return script
 
 
-if __name__ == "__main__":
-    test_doc = Path("src_html\wizard woes.html")
-    inliner = css_inline.CSSInliner()
+def setup_root(root_node: NodeGodot) -> None:
+    # Global.on_internal_link_press.connect(_on_internal_link_press)
+    script = setup_ready_script()
+    script.source = root_node.type
 
-    with open(test_doc, "r", encoding="utf-8") as f:
-        inlined = inliner.inline(f.read())
+    root_node.add_script(script)
+
+
+def main_output(src: Path) -> tuple[Path, str]:
+    return Path("."), "main"
 
-    soup = BeautifulSoup(inlined, features="lxml")
 
+PROFILE = PageProfile(
+    name="main",
+    root_name="HtmlNode",
+    root_type="ScrollContainer",
+    output=main_output,
     # mostly works
-    root_properties = {
+    root_properties={
         "size_flags_horizontal": 3,
         "size_flags_vertical": 3,
         "anchors_preset": 15,
@@ -60,38 +60,15 @@ if __name__ == "__main__":
         "anchor_bottom": 1.0,
         "horizontal_scroll_mode": 0,
         "vertical_scroll_mode": 2,
-    }
-
+    },
     # remove the head tag
-    soup.html.head.extract()
-
-    # remove main tag
-    # leaves only navbar and footer
-    soup.html.body.find(id="main").extract()
-
-    root_node = NodeGodot("HtmlNode", "ScrollContainer", properties=root_properties)
-
-    # Global.on_internal_link_press.connect(_on_internal_link_press)
-
-    script = setup_ready_script()
-    script.source = root_node.type
-
-    root_node.add_script(script)
-
-    scanner = HtmlScanner(soup.html)
-    tokens = scanner.scan_tokens()
-
-    parser = Parser(tokens, root_node=root_node)
-    nodes = parser.parse()
-
-    for child in nodes:
-        root_node.add_child(child)
-
-    scene = SceneGodot(root_node)
+    # remove main tag, leaves only navbar and footer
+    strip=("head", "#main"),
+    setup_root=setup_root,
+)
 
-    outfile = Path("main")
-    base_dir = Path("godot_output")
 
-    writer = SceneWriter(scene, base_dir, outfile)
-    writer.write_out_scene()
-    writer.write_out_resources()
+if __name__ == "__main__":
+    pipeline = SitePipeline()
+    outputs = pipeline.build_page(PROFILE, Path("src_html") / "wizard woes.html")
+    print(format_writes(outputs))
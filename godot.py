@@ -1,11 +1,71 @@
 from dataclasses import dataclass, field
-from random import choices
-from string import ascii_lowercase
+from hashlib import sha256
+from string import ascii_lowercase, digits
+from typing import ClassVar
 
+from css_units import ROOT_FONT_SIZE, convert_css_value_to_godot
 
-def generate_random_id():
-    res = "".join(choices(ascii_lowercase, k=5))
-    return res
+
+class SharedProperties(dict):
+    # a block of properties handed to every node of a kind,
+    # nodes copy it before setting anything of their own
+    __slots__ = ()
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError("shared node properties can't be modified")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = _frozen
+    setdefault = update = __ior__ = _frozen
+
+    def __reduce__(self):
+        return (SharedProperties, (dict(self),))
+
+
+# for every node that hasn't set a theme property of its own
+NO_THEME_PROPERTIES = SharedProperties()
+
+
+def godot_value(value) -> str:
+    # a property value the way it's written in a .tscn
+    match value:
+        case bool():
+            return str(value).lower()
+        case str():
+            return f'"{value}"'
+        case _:
+            return str(value)
+
+
+# theme_properties key -> the override it's written out as,
+# keys that aren't in here don't get written
+THEME_OVERRIDES = {
+    "margin_left": "theme_override_constants/margin_left",
+    "margin_right": "theme_override_constants/margin_right",
+    "margin_top": "theme_override_constants/margin_top",
+    "margin_bottom": "theme_override_constants/margin_bottom",
+    "font_size": "theme_override_font_sizes/font_size",
+    "normal_font_size": "theme_override_font_sizes/normal_font_size",
+}
+
+# the alphabet godot writes uids in, a-z then 0-9
+UID_CHARS = ascii_lowercase + digits
+
+
+def stable_id(*parts) -> int:
+    # the same parts always give the same (63 bit, like godot's) number
+    digest = sha256("\0".join(map(str, parts)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & 0x7FFFFFFFFFFFFFFF
+
+
+def uid_text(number: int) -> str:
+    # what comes after uid://, base 36 the same way godot does it
+    text = []
+    while True:
+        number, rest = divmod(number, len(UID_CHARS))
+        text.append(UID_CHARS[rest])
+        if not number:
+            break
+    return "".join(reversed(text))
 
 
 @dataclass
@@ -26,29 +86,40 @@ class FileDescriptorGodot:
         return f"[{self.resource_type} {load_steps} {format} {uid}]\n"
 
 
-@dataclass
+# big pages turn into tens of thousands of these, so they're slotted and
+# don't get a container of their own until something goes in it
+@dataclass(slots=True)
 class NodeGodot:
     name: str
     type: str
     parent: "NodeGodot" = None
     resource_type: str = "node"
-    _children: list["NodeGodot"] = field(default_factory=list)
-    _default_properties: dict = field(default_factory=dict)
+    # a list once there's a child, see add_child
+    _children: list["NodeGodot"] = ()
+    # child name -> last counter handed out for it, see add_child
+    _child_names: dict = None
+    # see node_path, None until something asks for it
+    _node_path: str = None
+    # the SceneGodot that indexed this node, told when anything gets attached
+    _scene: "SceneGodot" = field(default=None, repr=False, compare=False)
     properties: dict = field(default_factory=dict)
-    theme_properties: dict = field(default_factory=dict)
-    resources: list = field(default_factory=list)
+    # read only and shared until set_theme_property
+    theme_properties: dict = field(default_factory=lambda: NO_THEME_PROPERTIES)
+    # a list once there's a resource, see add_resource
+    resources: list = ()
     # for now its an external resource but probably want to unwrap it for this one
     script: "ExtResourceGodot" = None
-    connections: list["ConnectionGodot"] = field(default_factory=list)
+    connections: list["ConnectionGodot"] = ()
+
+    # what every node of the class starts out with, properties passed in win
+    DEFAULT_PROPERTIES: ClassVar[SharedProperties] = SharedProperties()
 
     def __post_init__(self):
         if self.parent:
             self.parent.add_child(self)
-            self.parent_path = self.handle_parent_text()
 
-        if self._default_properties:
-            self._default_properties.update(self.properties)
-            self.properties = self._default_properties
+        if self.DEFAULT_PROPERTIES:
+            self.properties = {**self.DEFAULT_PROPERTIES, **self.properties}
 
     @property
     def children(self):
@@ -56,15 +127,71 @@ class NodeGodot:
 
     @property
     def parent_path_str(self):
-        return self.handle_parent_text()
+        # "" for the root, "." for its children, then "a/b/..."
+        return self.parent.node_path if self.parent else ""
+
+    @property
+    def node_path(self) -> str:
+        # the path godot knows this node by, relative to the scene root,
+        # worked out once from the parent's and thrown away by add_child
+        if self._node_path is None:
+            # fill in from the closest ancestor that already has one
+            uncached = []
+            node = self
+            while node is not None and node._node_path is None:
+                uncached.append(node)
+                node = node.parent
+
+            for node in reversed(uncached):
+                if node.parent is None:
+                    node._node_path = "."
+                elif node.parent.parent is None:
+                    node._node_path = node.name
+                else:
+                    node._node_path = f"{node.parent._node_path}/{node.name}"
+
+        return self._node_path
+
+    def forget_node_path(self):
+        # after a move or rename, for this node and everything under it
+        # a path is only ever cached after its parent's, so the walk can
+        # stop at the first node without one (which is all of them while
+        # the parser is still putting the tree together)
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._node_path is not None:
+                node._node_path = None
+                stack.extend(node._children)
 
     def add_child(self, child):
-        if child.name in [node.name for node in self._children]:
-            suffix = generate_random_id()
-            child.name = f"{child.name}-{suffix}"
+        # repeats become text, text-2, text-3, ... so names (and node paths)
+        # come out the same every build, skipping any a child already has
+        if not self._children:
+            self._children = []
+            self._child_names = {}
+
+        names = self._child_names
+        if (count := names.get(child.name)) is not None:
+            base = child.name
+            while (name := f"{base}-{count + 1}") in names:
+                count += 1
+            names[base] = count + 1
+            child.name = name
+        names[child.name] = 1
 
         child.parent = self
+        child.forget_node_path()
         self._children.append(child)
+        if self._scene:
+            self._scene.changed()
+
+    def add_resource(self, resource: "ExtResourceGodot"):
+        if not self.resources:
+            self.resources = []
+        self.resources.append(resource)
+        if self._scene:
+            self._scene.changed()
 
     def add_script(self, script: "GDScriptResource"):
         if script_exists := self.script:
@@ -72,6 +199,8 @@ class NodeGodot:
                 script_exists.resource.add_function(func)
         else:
             self.script = ExtResourceGodot(script, path=self.name)
+            if self._scene:
+                self._scene.changed()
 
     def render(self) -> str:
         # header looks something like
@@ -112,24 +241,7 @@ class NodeGodot:
         return "".join(to_render)
 
     def handle_parent_text(self) -> str:
-        parent = self.parent
-        parent_text = []
-
-        while parent:
-            parent_text.append(parent.name)
-            parent = parent.parent
-
-        match len(parent_text):
-            case 0:
-                return ""
-            case 1:
-                parent_str = f"."
-                return parent_str
-            case _:
-                rev_parent = parent_text[::-1]
-                rev_parent.pop(0)
-                parent_str = "/".join(rev_parent)
-                return parent_str
+        return self.parent_path_str
 
     def _render_properties(self):
         prop_str = []
@@ -170,48 +282,15 @@ class NodeGodot:
     def renderable_properties(self):
         # this is called from the template
         # maybe a terrible decision in hindsight
-        renderable = {}
-        for k, v in self.properties.items():
-            match v:
-                case bool():
-                    s = str(v).lower()
-                    renderable[k] = s
-                case str():
-                    renderable[k] = f'"{v}"'
-                case _:
-                    renderable[k] = str(v)
-
-        return renderable
+        return {k: godot_value(v) for k, v in self.properties.items()}
 
     def renderable_theme_properties(self):
-        # where we would prepend like
-        # fstr = f"theme_override_constants/{k} = {s}"
-        renderable = {}
-        val = None
-        for k, v in self.theme_properties.items():
-            # handle formatting for value type
-            match v:
-                case bool():
-                    s = str(v).lower()
-                    val = s
-                case str():
-                    val = f'"{v}"'
-                case None:
-                    continue
-                case _:
-                    val = str(v)
-
-            # handle formatting for theme property type
-            # this could probably be somewhere else?
-            match k:
-                case "margin_left" | "margin_right" | "margin_top" | "margin_bottom":
-                    override_name = f"theme_override_constants/{k}"
-                    renderable[override_name] = val
-                case "font_size" | "normal_font_size":
-                    override_name = f"theme_override_font_sizes/{k}"
-                    renderable[override_name] = val
-            
-        return renderable
+        # also for the template, the native writer does the same inline
+        return {
+            THEME_OVERRIDES[k]: godot_value(v)
+            for k, v in self.theme_properties.items()
+            if v is not None and k in THEME_OVERRIDES
+        }
 
     def _render_node_resources(self):
         res_str = []
@@ -233,46 +312,50 @@ class NodeGodot:
         font_res = FontFileGodot()
         res = ExtResourceGodot(font_res, path=font_res.name)
         res.path = self.name
-        self.resources.append(res)
+        self.add_resource(res)
 
     def apply_font_size(self, size):
         pass
 
+    def set_theme_property(self, key, value):
+        # copy the shared block the first time the node sets one of its own
+        if isinstance(self.theme_properties, SharedProperties):
+            self.theme_properties = dict(self.theme_properties)
+        self.theme_properties[key] = value
 
-@dataclass
+
+@dataclass(slots=True)
 class HBoxContainer(NodeGodot):
     type: str = "HBoxContainer"
 
 
-@dataclass
+@dataclass(slots=True)
 class VBoxContainer(NodeGodot):
     type: str = "VBoxContainer"
 
 
-@dataclass
+@dataclass(slots=True)
 class RichTextLabel(NodeGodot):
     type: str = "RichTextLabel"
 
     def apply_font_size(self, size):
-        self.theme_properties["normal_font_size"] = size
+        self.set_theme_property("normal_font_size", size)
 
 
-@dataclass
+@dataclass(slots=True)
 class Label(NodeGodot):
     type: str = "Label"
 
     def apply_font_size(self, size):
-        self.theme_properties["font_size"] = size
+        self.set_theme_property("font_size", size)
 
-@dataclass
+LINK_THEME_PROPERTIES = SharedProperties({"font_size": None, "font": None})
+
+
+@dataclass(slots=True)
 class LinkButton(NodeGodot):
     type: str = "LinkButton"
-    theme_properties: dict = field(
-        default_factory=lambda: {
-            "font_size": None,
-            "font": None
-        }
-    )
+    theme_properties: dict = field(default_factory=lambda: LINK_THEME_PROPERTIES)
 
     def __post_init__(self):
         # hack for our homepage link class/id being empty
@@ -283,19 +366,19 @@ class LinkButton(NodeGodot):
             self.properties["link_name"] = "home"
     
     def apply_font_size(self, size):
-        self.theme_properties["font_size"] = size
+        self.set_theme_property("font_size", size)
 
-@dataclass
+@dataclass(slots=True)
 class LinkButtonExternal(NodeGodot):
     type: str = "LinkButton"
     
 
 
-@dataclass
+@dataclass(slots=True)
 class TextureRect(NodeGodot):
     type: str = "TextureRect"
-    _default_properties: dict = field(
-        default_factory=lambda: {
+    DEFAULT_PROPERTIES: ClassVar[SharedProperties] = SharedProperties(
+        {
             "layout_mode": 2,
             "size_flags_vertical": 3,
             "expand_mode": 5,
@@ -304,7 +387,7 @@ class TextureRect(NodeGodot):
     )
 
 
-@dataclass
+@dataclass(slots=True)
 class MarginContainer(NodeGodot):
     type: str = "MarginContainer"
     theme_properties: dict = field(
@@ -315,6 +398,8 @@ class MarginContainer(NodeGodot):
             "margin_bottom": None,
         }
     )
+    # computed font size of the element, what em margins are relative to
+    font_size: float = ROOT_FONT_SIZE
 
     def __post_init__(self):
         # just going to cheat and handle padding and margins the exact same way
@@ -338,7 +423,7 @@ class MarginContainer(NodeGodot):
         # case where margin is defined as something like
         # margin: 25px 50px 75px 100px;
         if pval := self.properties.get("margin"):
-            match pval.split(" "):
+            match pval.split():
                 case [all_pad]:
                     # change this later
                     for k, v in self.theme_properties.items():
@@ -401,7 +486,7 @@ class MarginContainer(NodeGodot):
         # case where padding is defined as something like
         # padding: 25px 50px 75px 100px;
         if pval := self.properties.get("padding"):
-            match pval.split(" "):
+            match pval.split():
                 case [all_pad]:
                     # change this later
                     for k, v in self.theme_properties.items():
@@ -467,12 +552,12 @@ class MarginContainer(NodeGodot):
         keys = list(self.theme_properties.keys())
         for k in keys:
             if v := self.theme_properties.get(k):
-                match self.convert_css_value_to_godot(v):
+                match convert_css_value_to_godot(v, self.font_size):
                     case ("script", _ as val):
                         frag = self.render_margin_fragment(k, val)
                         fragments.extend(frag)
                         del self.theme_properties[k]
-                    case ("int", _ as val):
+                    case ("int" | "float", _ as val):
                         self.theme_properties[k] = val
 
         if fragments:
@@ -483,44 +568,6 @@ class MarginContainer(NodeGodot):
 
             self.add_script(script)
 
-    # this may be used in other css values than just padding
-    def convert_css_value_to_godot(self, value) -> tuple:
-        if "px" in value:
-            return ("int", int(value[:-2]))
-        if "%" in value:
-            calc = int(value[:-1]) * 0.01
-            return ("int", calc)
-        if "vh" in value:
-            calc = int(value[:-2]) * 0.01
-            pad_str = f"{calc} * get_viewport().get_visible_rect().size.x"
-            return ("script", pad_str)
-        if "vw" in value:
-            calc = int(value[:-2]) * 0.01
-            pad_str = f"{calc} * get_viewport().get_visible_rect().size.y"
-            return ("script", pad_str)
-        if "auto" in value:
-            return ("str", "auto value")
-        if "rem" in value:
-            # rem is relative to size of root element font
-            # 1rem = the font size of the html element
-            # for now we will cheat and say it's 16px
-            multiplier = int(value[:-3])
-            fontsize = 16
-            calc = multiplier * fontsize
-            return ("int", calc)
-        if "em" in value:
-            # em is relative to font size of element
-            # 1em = whatever the size is, 2em = twice the size
-            # if no fontsize is defined, then default is 16px
-            # may need to figure out how to handle changes in fontsize later
-
-            multiplier = int(value[:-2])
-            fontsize = 16
-            calc = multiplier * fontsize
-            return ("int", calc)
-
-        return ("int", int(value))
-
     def render_margin_fragment(self, margin_dir, margin_val):
         define_str = f"var {margin_dir} = {margin_val}"
         add_theme_str = f'add_theme_constant_override("{margin_dir}", {margin_dir})'
@@ -613,7 +660,7 @@ class ExtResourceGodot:
     uid: str = ""
 
     def __post_init__(self):
-        self.id = f"{generate_random_id()}"
+        # id is handed out by the SceneGodot this ends up in
         # type will need to be handled different but
         match self.resource:
             case GDScriptResource():
@@ -666,57 +713,96 @@ class ExtResourceGodot:
 class SceneGodot:
     nodes: NodeGodot
     fd: FileDescriptorGodot = None
-    uid: str = "idk"
-    # _ext_resources: list['ExtResourceGodot'] = field(default_factory=list)
+    # where the scene gets written, ids and the uid are derived from it
+    # so rebuilding a page doesn't look like a new file to godot
+    path: str = ""
+    uid: str = None
     sub_resources: list = field(default_factory=list)
     connections: list = field(default_factory=list)
+    # what the templates need, all filled in by one walk in index() and only
+    # redone after a node in the tree says something was attached to it
+    _flat_nodes: list = field(default_factory=list, repr=False)
+    _ext_resources: list = field(default_factory=list, repr=False)
+    _scripts: list = field(default_factory=list, repr=False)
+    _dirty: bool = field(default=True, repr=False)
 
-    # i dont really need the load steps until im done / about to render the scene
     def __post_init__(self):
+        if self.uid is None:
+            self.uid = uid_text(stable_id(self.path, self.nodes.name))
         if not self.fd:
             self.fd = FileDescriptorGodot(1, self.uid)
-        self.fd.load_steps = len(self.ext_resources) + len(self.sub_resources) + 1
 
-    @property
-    def ext_resources(self) -> list[ExtResourceGodot]:
-        return self._collect_ext_resources(
-            self.nodes, [*self.nodes.resources, self.nodes.script]
-        )
+        self.index()
+
+    def changed(self):
+        self._dirty = True
+
+    def index(self):
+        if not self._dirty:
+            return
+
+        flat_nodes = []
+        # (owner, resource) in the order they're written out
+        owned = []
+        scripts = []
+        # a font (or image) used by many nodes is one ext_resource in the scene,
+        # owned by the first node that asked for it and shared with the rest
+        shared = {}
+
+        # the root is no different, it only has a script if the page has links
+        for node in [self.nodes, *self._walk(self.nodes)]:
+            node._scene = self
+            flat_nodes.append(node)
+            if node.resources:
+                for resource in node.resources:
+                    key = (resource.type, resource.path_str)
+                    if key not in shared:
+                        shared[key] = resource
+                        owned.append((node, resource))
+                node.resources = [
+                    shared[resource.type, resource.path_str]
+                    for resource in node.resources
+                ]
+            if script := node.script:
+                owned.append((node, script))
+                scripts.append(script)
 
-    def _collect_ext_resources(
-        self, node: NodeGodot, resources=None
-    ) -> list[ExtResourceGodot]:
-        for child in node.children:
-            if resource := child.resources:
-                resources.extend(resource)
-            if script := child.script:
-                resources.append(script)
+        self.assign_ids(owned)
 
-            self._collect_ext_resources(child, resources)
+        self._flat_nodes = flat_nodes
+        self._ext_resources = [resource for _, resource in owned]
+        self._scripts = scripts
+        self.fd.load_steps = len(self._ext_resources) + len(self.sub_resources) + 1
+        self._dirty = False
 
-        return resources
+    def assign_ids(self, owned: list[tuple[NodeGodot, ExtResourceGodot]]) -> None:
+        # godot style "1_abcde", the number keeps them unique in the scene and
+        # the rest comes from the page and the node the resource belongs to
+        for index, (node, resource) in enumerate(owned, start=1):
+            number = stable_id(
+                self.path, node.node_path, resource.type, resource.path
+            )
+            resource.id = f"{index}_{uid_text(number)[-5:]}"
 
     @property
-    def scripts(self) -> list[ExtResourceGodot]:
-        return self._collect_node_scripts(self.nodes, [self.nodes.script])
-
-    def _collect_node_scripts(
-        self, node: NodeGodot, scripts=None
-    ) -> list[ExtResourceGodot]:
-        for child in node.children:
-            if script := child.script:
-                scripts.append(script)
-
-            self._collect_node_scripts(child, scripts)
+    def ext_resources(self) -> list[ExtResourceGodot]:
+        self.index()
+        return self._ext_resources
 
-        return scripts
+    @property
+    def scripts(self) -> list[ExtResourceGodot]:
+        self.index()
+        return self._scripts
 
     def flat_nodes(self) -> list[NodeGodot]:
-        return self._flatten_nodes(self.nodes, [self.nodes])
-
-    def _flatten_nodes(self, node, nodes) -> list[NodeGodot]:
-        for n in node.children:
-            nodes.append(n)
-            self._flatten_nodes(n, nodes)
-
-        return nodes
+        self.index()
+        return self._flat_nodes
+
+    def _walk(self, node: NodeGodot):
+        # every node under node in document order, with a stack instead of
+        # recursion so deeply nested pages don't hit the recursion limit
+        stack = node.children[::-1]
+        while stack:
+            child = stack.pop()
+            yield child
+            stack.extend(child.children[::-1])
@@ -0,0 +1,40 @@
+from collections import Counter
+
+
+class HandlerStats:
+    # how often each scanner/parser handler ran and how long it took
+    # parser openers and closers are timed separately, neither includes
+    # the children built in between
+    def __init__(self) -> None:
+        self.calls = Counter()
+        self.seconds = Counter()
+
+    def record(self, handler: str, seconds: float) -> None:
+        self.calls[handler] += 1
+        self.seconds[handler] += seconds
+
+    def update(self, other: "HandlerStats") -> None:
+        self.calls.update(other.calls)
+        self.seconds.update(other.seconds)
+
+    def take(self) -> "HandlerStats":
+        # hand the counts back (to the main process) and start over
+        stats = HandlerStats()
+        stats.update(self)
+        self.calls.clear()
+        self.seconds.clear()
+        return stats
+
+    def __bool__(self) -> bool:
+        return bool(self.calls)
+
+    def report(self) -> str:
+        lines = [f"{'handler':<24} {'calls':>10} {'seconds':>10} {'us/call':>10}"]
+        for handler, seconds in self.seconds.most_common():
+            calls = self.calls[handler]
+            per_call = seconds / calls * 1_000_000
+            lines.append(
+                f"{handler:<24} {calls:>10} {seconds:>10.3f} {per_call:>10.2f}"
+            )
+
+        return "\n".join(lines)
@@ -0,0 +1,208 @@
+import json
+
+from dataclasses import dataclass, field
+from functools import cache
+from hashlib import sha256
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urlparse
+
+PACKAGE_DIR = Path(__file__).parent
+TEMPLATE_DIR = PACKAGE_DIR / "templates"
+
+# anything in here changing means every page has to be rebuilt
+CONVERTER_SOURCES = [
+    "tag_token.py",
+    "scanner.py",
+    "node_parser.py",
+    "style_context.py",
+    "css_units.py",
+    "godot.py",
+    "render_godot.py",
+    "pipeline.py",
+    "page_content.py",
+    "generate_main.py",
+    "generate_home_content.py",
+    "tag_plugins.py",
+    "css_engine.py",
+]
+
+MANIFEST_NAME = ".build_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def hash_bytes(data: bytes) -> str:
+    return sha256(data).hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hash_bytes(f.read())
+
+
+@cache
+def source_version(*names: str) -> str:
+    digest = sha256()
+    for name in names:
+        digest.update(name.encode())
+        digest.update(hash_file(PACKAGE_DIR / name).encode())
+
+    return digest.hexdigest()
+
+
+def converter_version() -> str:
+    return source_version(*CONVERTER_SOURCES)
+
+
+def template_hashes() -> dict[str, str]:
+    return {
+        f"templates/{template.name}": hash_file(template)
+        for template in sorted(TEMPLATE_DIR.glob("*.j2"))
+    }
+
+
+class StylesheetLinks(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.hrefs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "link":
+            return
+
+        attrs = dict(attrs)
+        if "stylesheet" in (attrs.get("rel") or "").split() and attrs.get("href"):
+            self.hrefs.append(attrs["href"])
+
+
+def linked_stylesheets(src: Path, html: str) -> list[Path]:
+    links = StylesheetLinks()
+    links.feed(html)
+
+    sheets = []
+    for href in links.hrefs:
+        if sheet := resolve_stylesheet(src, href):
+            sheets.append(sheet)
+
+    return sheets
+
+
+def resolve_stylesheet(src: Path, href: str) -> Path:
+    parsed = urlparse(href)
+    if parsed.scheme or parsed.netloc:
+        # remote stylesheets are out of our hands
+        return None
+
+    # css_inline resolves relative to the working dir,
+    # fall back to next to the page for everything else
+    for candidate in [Path(parsed.path), src.parent / parsed.path]:
+        if candidate.is_file():
+            return candidate
+
+    return None
+
+
+# inputs that aren't files
+NOT_FILES = ("converter", "options")
+
+
+def page_inputs(src: Path, options: dict = None) -> dict[str, str]:
+    # options are the build options that change the output (--css and co),
+    # a page built one way isn't up to date for a build the other way
+    with open(src, "rb") as f:
+        raw = f.read()
+
+    inputs = {"converter": converter_version(), str(src.as_posix()): hash_bytes(raw)}
+    if options:
+        inputs["options"] = " ".join(f"{k}={v}" for k, v in sorted(options.items()))
+
+    for sheet in linked_stylesheets(src, raw.decode("utf-8", errors="replace")):
+        inputs[sheet.as_posix()] = hash_file(sheet)
+
+    inputs.update(template_hashes())
+
+    return inputs
+
+
+def page_key(profile_name: str, src: Path) -> str:
+    return f"{profile_name}:{src.as_posix()}"
+
+
+@dataclass
+class PageRecord:
+    inputs: dict[str, str]
+    outputs: list[str] = field(default_factory=list)
+
+
+@dataclass
+class BuildManifest:
+    path: Path
+    pages: dict[str, PageRecord] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, output_dir) -> "BuildManifest":
+        path = Path(output_dir) / MANIFEST_NAME
+        manifest = cls(path)
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return manifest
+
+        if data.get("version") != MANIFEST_VERSION:
+            return manifest
+
+        for key, record in data.get("pages", {}).items():
+            manifest.pages[key] = PageRecord(record["inputs"], record["outputs"])
+
+        return manifest
+
+    def save(self) -> None:
+        data = {
+            "version": MANIFEST_VERSION,
+            "pages": {
+                key: {"inputs": record.inputs, "outputs": record.outputs}
+                for key, record in sorted(self.pages.items())
+            },
+        }
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+
+    def is_fresh(self, key: str, inputs: dict[str, str]) -> bool:
+        if not (record := self.pages.get(key)):
+            return False
+
+        if record.inputs != inputs:
+            return False
+
+        # somebody deleted the output, so it isn't really up to date
+        return all(Path(output).is_file() for output in record.outputs)
+
+    def record(self, key: str, inputs: dict[str, str], outputs: list) -> list[str]:
+        # returns whatever the page used to output but doesn't any more
+        old = self.pages.get(key)
+        record = PageRecord(inputs, [Path(o).as_posix() for o in outputs])
+        self.pages[key] = record
+
+        if not old:
+            return []
+        return [o for o in old.outputs if o not in record.outputs]
+
+    def drop_missing(self) -> list[str]:
+        # forget the pages whose source is gone, returns their outputs
+        # (a page only missing from this run's --pages glob is kept)
+        outputs = []
+        for key in list(self.pages):
+            _, src = key.split(":", 1)
+            if not Path(src).is_file():
+                outputs.extend(self.pages.pop(key).outputs)
+
+        return outputs
+
+    def unowned(self, outputs: list[str]) -> list[str]:
+        # the ones no page outputs (some files, like scripts, are shared)
+        owned = {o for record in self.pages.values() for o in record.outputs}
+        return [o for o in dict.fromkeys(outputs) if o not in owned]
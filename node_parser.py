@@ -1,6 +1,8 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from time import perf_counter
 from urllib.parse import urlparse
 from functools import singledispatch
+from typing import Callable
 
 from godot import (
     ExtResourceGodot,
@@ -18,7 +20,10 @@ from godot import (
     Label,
     TextureRect,
 )
-from tag_token import TagCategory, Token
+from css_units import resolve_font_size
+from handler_stats import HandlerStats
+from style_context import StyleContext
+from tag_token import TagCategory, Token, TokenBuffer, TokenStream
 
 
 def make_rich_text_label(name, text, extra_properties=None):
@@ -48,7 +53,7 @@ def on_link_button_pressed_func(method_name, path_to_node):
 
 def attach_resource(node: NodeGodot, resource) -> None:
     resource.path = node.name
-    node.resources.append(resource)
+    node.add_resource(resource)
 
 
 def render_connection_fragment(var_name, node_path, signal, method_name):
@@ -72,373 +77,440 @@ def render_connection_fragment(var_name, node_path, signal, method_name):
 class TokenNode:
     token: Token
     node: NodeGodot
+    # computed font size in px, see Parser.font_size
+    font_size: float = None
 
 
-class Parser:
-    def __init__(self, tokens, root_node=None) -> None:
-        self.tokens = tokens
-        self.current = 0
-        self.root_node = root_node
-        self.style_ctx = []
-
-    def parse(self) -> list[NodeGodot]:
-        nodes = []
-
-        while not self.is_at_end():
-            node = self.make_node()
-            nodes.append(node)
-
-        return nodes
-
-    def make_node(self) -> NodeGodot:
-        if self.match(TagCategory.HEAD):
-            node = self.basic_node()
-
-            tk_node = TokenNode(self.previous(), node)
-
-            self.apply_class_options_to_node(tk_node)
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+@dataclass(slots=True)
+class OpenTag:
+    # a tag whose START_CHILDREN we're inside of, closed at its END_CHILDREN
+    close: Callable
+    state: TokenNode
+    # what Parser.style goes back to once it's closed
+    outer_style: StyleContext
+    children: list = field(default_factory=list)
 
-            for child in self.if_children_make_nodes():
-                node.add_child(child)
 
-            return node
+# token kind -> (opener, closer) Parser methods
+# the opener is called right after the tag's token is consumed. If there's a
+# closer the opener returns a TokenNode and the closer gets it back along with
+# the children once its END_CHILDREN is reached, (tk_node, children) -> node.
+# Without a closer the opener returns the finished node and a START_CHILDREN
+# after it is left for whoever comes next.
+# anything not in here gets FLOW_HANDLERS
+# plugins (see tag_plugins.py) add their own with @handles/@closes
+PARSE_HANDLERS = {}
 
-        if self.match(TagCategory.BODY):
-            node = self.basic_node()
 
-            tk_node = TokenNode(self.previous(), node)
+def handles(*kinds: TagCategory):
+    def register(opener):
+        for kind in kinds:
+            _, closer = PARSE_HANDLERS.get(kind, (None, None))
+            PARSE_HANDLERS[kind] = (opener, closer)
+        return opener
 
-            self.apply_class_options_to_node(tk_node)
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+    return register
 
-            self.style_ctx.append(self.tag_style_to_dict(tk_node.token.attrs))
 
-            for child in self.if_children_make_nodes():
-                tk_node.node.add_child(child)
+def closes(*kinds: TagCategory):
+    def register(closer):
+        for kind in kinds:
+            opener, _ = PARSE_HANDLERS.get(kind, (None, None))
+            PARSE_HANDLERS[kind] = (opener, closer)
+        return closer
 
-            self.style_ctx.pop()
+    return register
 
-            # if margin := self.margin_node(tk_node):
-            #     margin.add_child(tk_node.node)
-            #     return margin
 
-            return tk_node.node
-
-        if self.match(TagCategory.NAV):
-            node = self.basic_node()
-
-            tk_node = TokenNode(self.previous(), node)
-            self.apply_class_options_to_node(tk_node)
-            # need to figure out better way to not overwrite
-            # self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+class Parser:
+    # tokens can be a TokenStream, a list or the scanner's generator,
+    # either way we only ever look one token ahead and one behind
+    #
+    # no recursion, every tag whose children we're in is on an explicit
+    # stack, so how deep the html nests doesn't matter
+    #
+    # pass a HandlerStats to count and time every handler call
+    def __init__(self, tokens, root_node=None, stats: HandlerStats = None) -> None:
+        if isinstance(tokens, TokenStream):
+            self.tokens = tokens.cursor()
+        else:
+            self.tokens = TokenBuffer(tokens)
+        self.root_node = root_node
+        # styles inherited from the tags we're inside of
+        self.style = StyleContext()
+        self.stats = stats
 
-            for child in self.if_children_make_nodes():
-                tk_node.node.add_child(child)
+    def parse(self) -> list[NodeGodot]:
+        nodes = []
+        stack = []
 
-            # if margin := self.margin_node(tk_node):
-            #     margin.add_child(tk_node.node)
-            #     return margin
+        while True:
+            kind = self.tokens.peek_kind()
 
-            return tk_node.node
+            if kind == TagCategory.END_CHILDREN and stack:
+                self.advance()
+                open_tag = stack.pop()
+                node = self.call(open_tag.close, open_tag.state, open_tag.children)
+                self.style = open_tag.outer_style
+                (stack[-1].children if stack else nodes).append(node)
+                continue
+
+            if kind == TagCategory.EOF:
+                if stack:
+                    error = "Start of children need END OF CHILDREN"
+                    raise Exception(self.peek(), error)
+                return nodes
+
+            # one dict lookup instead of a match per kind, see PARSE_HANDLERS
+            opener, closer = PARSE_HANDLERS.get(kind, FLOW_HANDLERS)
+            self.advance()
+
+            state = self.call(opener)
+            if closer is None:
+                node = state
+            elif self.check(TagCategory.START_CHILDREN):
+                self.advance()
+                stack.append(OpenTag(closer, state, self.style))
+                # children (and the closer) see this tag's styles
+                self.style = self.style.child(state.token.style)
+                continue
+            else:
+                node = self.call(closer, state, [])
 
-        if self.match(TagCategory.FOOTER):
-            node = self.basic_node()
+            (stack[-1].children if stack else nodes).append(node)
 
-            tk_node = TokenNode(self.previous(), node)
+    def call(self, handler, *args):
+        if self.stats is None:
+            return handler(self, *args)
 
-            self.apply_class_options_to_node(tk_node)
-            # self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+        start = perf_counter()
+        result = handler(self, *args)
+        self.stats.record(handler.__name__, perf_counter() - start)
 
-            self.style_ctx.append(self.tag_style_to_dict(tk_node.token.attrs))
+        return result
 
-            for child in self.if_children_make_nodes():
-                tk_node.node.add_child(child)
+    def add_children(self, tk_node: TokenNode, children: list) -> None:
+        for child in children:
+            tk_node.node.add_child(child)
 
-            self.style_ctx.pop()
+    @handles(TagCategory.HEAD)
+    def open_head(self) -> TokenNode:
+        node = self.basic_node()
 
-            if margin := self.margin_node(tk_node):
-                margin.add_child(tk_node.node)
-                return margin
+        tk_node = TokenNode(self.previous(), node)
 
-            return tk_node.node
+        self.apply_class_options_to_node(tk_node)
+        self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
 
-        if self.match(TagCategory.DIV):
-            node = self.basic_node()
+        return tk_node
 
-            tk_node = TokenNode(self.previous(), node)
+    @handles(TagCategory.BODY)
+    def open_body(self) -> TokenNode:
+        node = self.basic_node()
 
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
-            self.apply_class_options_to_node(tk_node)
+        tk_node = TokenNode(self.previous(), node)
 
-            self.style_ctx.append(self.tag_style_to_dict(tk_node.token.attrs))
+        self.apply_class_options_to_node(tk_node)
+        self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
 
-            for child in self.if_children_make_nodes():
-                tk_node.node.add_child(child)
+        return tk_node
 
-            self.style_ctx.pop()
+    @closes(TagCategory.BODY)
+    def close_body(self, tk_node: TokenNode, children: list) -> NodeGodot:
+        self.add_children(tk_node, children)
 
-            if margin := self.margin_node(tk_node):
-                margin.add_child(tk_node.node)
-                return margin
+        # if margin := self.margin_node(tk_node):
+        #     margin.add_child(tk_node.node)
+        #     return margin
 
-            return tk_node.node
+        return tk_node.node
 
-        if self.match(TagCategory.A):
-            # need to handle if an internal link vs a real external link
-            link_attrs = self.link_attributes()
-            link_prop = {"unique_name_in_owner": True, "size_flags_horizontal": 0}
-            link_prop.update(link_attrs)
+    @handles(TagCategory.NAV)
+    def open_nav(self) -> TokenNode:
+        node = self.basic_node()
 
-            match link_prop:
-                case {"uri": _ as uri}:
-                    node = LinkButtonExternal("link", properties=link_prop)
-                case {"link_name": _ as link_name}:
-                    # del link_name["name"]
-                    node = LinkButton(link_name, properties=link_prop)
+        tk_node = TokenNode(self.previous(), node)
+        self.apply_class_options_to_node(tk_node)
+        # need to figure out better way to not overwrite
+        # self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
 
-            tk_node = TokenNode(self.previous(), node)
+        return tk_node
 
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+    @closes(TagCategory.NAV)
+    def close_nav(self, tk_node: TokenNode, children: list) -> NodeGodot:
+        self.add_children(tk_node, children)
 
-            self.style_ctx.append(self.tag_style_to_dict(tk_node.token.attrs))
+        # if margin := self.margin_node(tk_node):
+        #     margin.add_child(tk_node.node)
+        #     return margin
 
-            for child in self.if_children_make_nodes():
-                if child_text := child.properties.get("text"):
-                    node.properties["text"] = child_text
+        return tk_node.node
 
-            self.style_ctx.pop()
+    @handles(TagCategory.FOOTER)
+    def open_footer(self) -> TokenNode:
+        node = self.basic_node()
 
-            # set up the script fragments
-            # Not sure if this is the right place for it
-            # but not sure where else would be better
-            match node:
-                case LinkButtonExternal():
-                    pass
-                case LinkButton():
-                    # set up the connection, can probably be refactored
-                    connection_path = f"{node.name}".replace("-", "_")
-                    method_name = f"_{connection_path}_on_button_pressed"
-
-                    # make the "_ready" function
-                    # so we can cheat and make these unique names
-                    ready_fragment = render_connection_fragment(
-                        connection_path, f"%{node.name}", "pressed", method_name
-                    )
+        tk_node = TokenNode(self.previous(), node)
 
-                    # make our function that we call script
-                    path_to_node = (
-                        tk_node.node.properties["link_path"]
-                        + tk_node.node.properties["link_name"]
-                    )
+        self.apply_class_options_to_node(tk_node)
+        # self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
 
-                    fragment = on_link_button_pressed_func(method_name, path_to_node)
-                    # shoe-horn in our signal emitter
-                    fragment.code.append("Global.on_internal_link_press.emit()")
-                    if root := self.root_node:
-                        ready = ScriptFunction("_ready", ready_fragment)
-                        script = GDScriptResource(source="Node")
+        return tk_node
 
-                        for f in [ready, fragment]:
-                            script.add_function(f)
+    @handles(TagCategory.DIV)
+    def open_div(self) -> TokenNode:
+        node = self.basic_node()
 
-                        root.add_script(script)
+        tk_node = TokenNode(self.previous(), node)
 
-            if margin := self.margin_node(tk_node):
-                margin.add_child(tk_node.node)
-                return margin
+        self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
+        self.apply_class_options_to_node(tk_node)
 
-            return node
+        return tk_node
 
-        if self.match(TagCategory.UL):
-            node = self.basic_node()
+    @closes(TagCategory.FOOTER, TagCategory.DIV)
+    def close_block(self, tk_node: TokenNode, children: list) -> NodeGodot:
+        self.add_children(tk_node, children)
 
-            tk_node = TokenNode(self.previous(), node)
-            self.apply_class_options_to_node(tk_node)
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+        if margin := self.margin_node(tk_node):
+            margin.add_child(tk_node.node)
+            return margin
 
-            self.style_ctx.append(self.tag_style_to_dict(tk_node.token.attrs))
+        return tk_node.node
 
-            for child in self.if_children_make_nodes():
-                tk_node.node.add_child(child)
+    @handles(TagCategory.A)
+    def open_link(self) -> TokenNode:
+        # need to handle if an internal link vs a real external link
+        link_attrs = self.link_attributes()
+        link_prop = {"unique_name_in_owner": True, "size_flags_horizontal": 0}
+        link_prop.update(link_attrs)
 
-            self.style_ctx.pop()
+        match link_prop:
+            case {"uri": _ as uri}:
+                node = LinkButtonExternal("link", properties=link_prop)
+            case {"link_name": _ as link_name}:
+                # del link_name["name"]
+                node = LinkButton(link_name, properties=link_prop)
 
-            return tk_node.node
+        tk_node = TokenNode(self.previous(), node)
 
-        if self.match(TagCategory.LI):
-            node = self.basic_node()
+        self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
 
-            tk_node = TokenNode(self.previous(), node)
-            self.apply_class_options_to_node(tk_node)
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+        return tk_node
 
-            self.style_ctx.append(self.tag_style_to_dict(tk_node.token.attrs))
+    @closes(TagCategory.A)
+    def close_link(self, tk_node: TokenNode, children: list) -> NodeGodot:
+        node = tk_node.node
 
-            for child in self.if_children_make_nodes():
-                tk_node.node.add_child(child)
+        for child in children:
+            if child_text := child.properties.get("text"):
+                node.properties["text"] = child_text
 
-            self.style_ctx.pop()
+        # set up the script fragments
+        # Not sure if this is the right place for it
+        # but not sure where else would be better
+        match node:
+            case LinkButtonExternal():
+                pass
+            case LinkButton():
+                # set up the connection, can probably be refactored
+                connection_path = f"{node.name}".replace("-", "_")
+                method_name = f"_{connection_path}_on_button_pressed"
 
-            return tk_node.node
+                # make the "_ready" function
+                # so we can cheat and make these unique names
+                ready_fragment = render_connection_fragment(
+                    connection_path, f"%{node.name}", "pressed", method_name
+                )
 
-        if self.match(TagCategory.H1):
-            name = self.make_name_tag()
-            node = make_rich_text_label(name, self.previous().str_val)
-            tk_node = TokenNode(self.previous(), node)
-            # self.apply_class_options_to_node(tk_node)
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+                # make our function that we call script
+                path_to_node = (
+                    tk_node.node.properties["link_path"]
+                    + tk_node.node.properties["link_name"]
+                )
 
-            self.style_ctx.append(self.tag_style_to_dict(tk_node.token.attrs))
+                fragment = on_link_button_pressed_func(method_name, path_to_node)
+                # shoe-horn in our signal emitter
+                fragment.code.append("Global.on_internal_link_press.emit()")
+                if root := self.root_node:
+                    ready = ScriptFunction("_ready", ready_fragment)
+                    script = GDScriptResource(source="Node")
 
-            for child in self.if_children_make_nodes():
-                tk_node.node.add_child(child)
+                    for f in [ready, fragment]:
+                        script.add_function(f)
 
-            self.style_ctx.pop()
+                    root.add_script(script)
 
-            if margin := self.margin_node(tk_node):
-                margin.add_child(tk_node.node)
-                return margin
+        if margin := self.margin_node(tk_node):
+            margin.add_child(tk_node.node)
+            return margin
 
-            return tk_node.node
+        return node
 
-        if self.match(TagCategory.H4):
-            name = self.make_name_tag()
-            node = make_rich_text_label(name, self.previous().str_val)
+    @handles(TagCategory.UL, TagCategory.LI)
+    def open_list(self) -> TokenNode:
+        node = self.basic_node()
 
-            tk_node = TokenNode(self.previous(), node)
-            # self.apply_class_options_to_node(tk_node)
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+        tk_node = TokenNode(self.previous(), node)
+        self.apply_class_options_to_node(tk_node)
+        self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
 
-            self.style_ctx.append(self.tag_style_to_dict(tk_node.token.attrs))
+        return tk_node
 
-            for child in self.if_children_make_nodes():
-                tk_node.node.add_child(child)
+    @closes(TagCategory.UL, TagCategory.LI)
+    def close_list(self, tk_node: TokenNode, children: list) -> NodeGodot:
+        self.add_children(tk_node, children)
 
-            self.style_ctx.pop()
+        return tk_node.node
 
-            if margin := self.margin_node(tk_node):
-                margin.add_child(tk_node.node)
-                return margin
+    @handles(TagCategory.H1, TagCategory.H4)
+    def open_heading(self) -> TokenNode:
+        name = self.make_name_tag()
+        node = make_rich_text_label(name, self.previous().str_val)
+        tk_node = TokenNode(self.previous(), node)
+        # self.apply_class_options_to_node(tk_node)
+        self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
+
+        return tk_node
+
+    @closes(TagCategory.H1, TagCategory.H4)
+    def close_heading(self, tk_node: TokenNode, children: list) -> NodeGodot:
+        self.add_children(tk_node, children)
+
+        if margin := self.margin_node(tk_node):
+            margin.add_child(tk_node.node)
+            return margin
+
+        return tk_node.node
+
+    @handles(TagCategory.P)
+    def open_paragraph(self) -> TokenNode:
+        node = self.basic_node()
+
+        tk_node = TokenNode(self.previous(), node)
+        self.apply_class_options_to_node(tk_node)
+        self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
+
+        return tk_node
+
+    @closes(TagCategory.P)
+    def close_paragraph(self, tk_node: TokenNode, children: list) -> NodeGodot:
+        unjoined = []
+        for child in children:
+            match child.type:
+                case "Label":
+                    if text := child.properties.get("text"):
+                        unjoined.append(text)
+                case "RichTextLabel":
+                    if text := child.properties.get("text"):
+                        unjoined.append(text)
+                case _:
+                    if unjoined:
+                        child_text = " ".join(unjoined)
+                        child_unjoined = make_rich_text_label("text", child_text)
+                        tk_node.node.add_child(child_unjoined)
+                        unjoined = []
 
-            return tk_node.node
+                    tk_node.node.add_child(child)
 
-        if self.match(TagCategory.P):
-            node = self.basic_node()
+        if unjoined:
+            child_text = " ".join(unjoined)
+            child = make_rich_text_label("text", child_text)
+            temp_node = TokenNode(self.previous(), child)
+            self.apply_font_style_to_node(temp_node)
+            tk_node.node.add_child(child)
 
-            tk_node = TokenNode(self.previous(), node)
-            self.apply_class_options_to_node(tk_node)
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+        return tk_node.node
 
-            unjoined = []
-            for child in self.if_children_make_nodes():
-                match child.type:
-                    case "Label":
-                        if text := child.properties.get("text"):
-                            unjoined.append(text)
-                    case "RichTextLabel":
-                        if text := child.properties.get("text"):
-                            unjoined.append(text)
-                    case _:
-                        if unjoined:
-                            child_text = " ".join(unjoined)
-                            child_unjoined = make_rich_text_label("text", child_text)
-                            tk_node.node.add_child(child_unjoined)
-                            unjoined = []
+    @handles(TagCategory.BLOCKQUOTE)
+    def open_blockquote(self) -> TokenNode:
+        # basically just a paragraph but with some other shit
+        node = self.basic_node()
 
-                        tk_node.node.add_child(child)
+        tk_node = TokenNode(self.previous(), node)
+        self.apply_class_options_to_node(tk_node)
+        self.apply_style_to_node(tk_node)
+        self.apply_font_style_to_node(tk_node)
 
-            if unjoined:
-                child_text = " ".join(unjoined)
-                child = make_rich_text_label("text", child_text)
-                temp_node = TokenNode(self.previous(), child)
-                self.apply_font_style_to_node(temp_node)
-                tk_node.node.add_child(child)
+        return tk_node
 
-            return tk_node.node
+    @closes(TagCategory.HEAD, TagCategory.BLOCKQUOTE)
+    def close_container(self, tk_node: TokenNode, children: list) -> NodeGodot:
+        self.add_children(tk_node, children)
 
-        if self.match(TagCategory.BLOCKQUOTE):
-            # basically just a paragraph but with some other shit
-            node = self.basic_node()
+        return tk_node.node
 
-            tk_node = TokenNode(self.previous(), node)
-            self.apply_class_options_to_node(tk_node)
-            self.apply_style_to_node(tk_node)
-            self.apply_font_style_to_node(tk_node)
+    @handles(TagCategory.SPAN)
+    def make_span(self) -> NodeGodot:
+        prev = self.previous()
+        match prev.style:
+            case {"color": _ as color_val}:
+                text = f"[color={color_val}]{prev.str_val}[/color]"
+            case _:
+                text = prev.str_val
 
-            for child in self.if_children_make_nodes():
-                tk_node.node.add_child(child)
+        node = make_rich_text_label("text", text)
 
-            return tk_node.node
+        return node
 
-        if self.match(TagCategory.SPAN):
-            prev = self.previous()
-            if style_dict := self.tag_style_to_dict(prev.attrs):
-                match style_dict:
-                    case {"color": _ as color_val}:
-                        text = f"[color={color_val}]{prev.str_val}[/color]"
-                    case _:
-                        text = prev.str_val
+    @handles(TagCategory.IMG)
+    def make_img(self) -> NodeGodot:
+        prev = self.previous()
+        node = TextureRect("img")
+        fname = prev.attrs.get("src").split("/")[-1]
+        img_texture = Texture2DGodot(fname)
+        res = ExtResourceGodot(img_texture, path=node.name)
 
-            node = make_rich_text_label("text", text)
+        attach_resource(node, res)
+        return node
 
-            return node
+    @handles(TagCategory.EM)
+    def make_em(self) -> NodeGodot:
+        text = f"[i]{self.previous().str_val}[/i]"
+        node = make_rich_text_label("text", text)
 
-        if self.match(TagCategory.IMG):
-            prev = self.previous()
-            node = TextureRect("img")
-            fname = prev.attrs.get("src").split("/")[-1]
-            img_texture = Texture2DGodot(fname)
-            res = ExtResourceGodot(img_texture, path=node.name)
+        return node
 
-            attach_resource(node, res)
-            return node
+    @handles(TagCategory.TEXT)
+    def make_text(self) -> NodeGodot:
+        text = self.previous().str_val
 
-        if self.match(TagCategory.EM):
-            text = f"[i]{self.previous().str_val}[/i]"
-            node = make_rich_text_label("text", text)
+        # rich text label issues zzzz
+        # node = make_rich_text_label("text", text)
+        properties = {
+            "layout_mode": 2,
+            "fit_content": True,
+            "autowrap_mode": 0,
+            "text": text,
+        }
 
-            return node
+        node = Label("text", properties=properties)
+        tk_node = TokenNode(self.previous(), node)
 
-        if self.match(TagCategory.TEXT):
-            text = self.previous().str_val
+        self.apply_font_style_to_node(tk_node)
 
-            # rich text label issues zzzz
-            # node = make_rich_text_label("text", text)
-            properties = {
-                "layout_mode": 2,
-                "fit_content": True,
-                "autowrap_mode": 0,
-                "text": text,
-            }
-
-            node = Label("text", properties=properties)
-            tk_node = TokenNode(self.previous(), node)
-
-            self.apply_font_style_to_node(tk_node)
-
-            return node
+        return node
 
+    def open_flow(self) -> TokenNode:
         # for all the other classes we gotta support
-        self.advance()
         name = self.make_name_tag()
         node = NodeGodot(name, "VBoxContainer")
 
-        for child in self.if_children_make_nodes():
-            node.add_child(child)
+        return TokenNode(self.previous(), node)
 
-        return node
+    def close_flow(self, tk_node: TokenNode, children: list) -> NodeGodot:
+        self.add_children(tk_node, children)
+
+        return tk_node.node
 
     def link_attributes(self):
         # will need to figure out if we actually need the name or not
@@ -476,7 +548,7 @@ class Parser:
 
     def margin_node(self, tk_node: TokenNode) -> MarginContainer:
         # oh yeah this needs to be fixed
-        if style_dict := self.tag_style_to_dict(tk_node.token.attrs):
+        if style_dict := tk_node.token.style:
             match style_dict:
                 case (
                     {"padding": _}
@@ -492,48 +564,17 @@ class Parser:
                 ):
                     name = f"{tk_node.node.name}-margin"
                     # THIS IS WHERE WE SHOULD DO ALL THE STYLING AND THEN PASS IT
-                    return MarginContainer(name, properties=style_dict)
+                    return MarginContainer(
+                        name,
+                        properties=dict(style_dict),
+                        font_size=self.font_size(tk_node),
+                    )
 
         return None
 
     def make_name_tag(self) -> str:
-        prev = self.previous()
-        cnt = 1
-        while prev.name in [TagCategory.START_CHILDREN, TagCategory.END_CHILDREN]:
-            cnt += 1
-            prev = self.previous_n(cnt)
-
-        return self.handle_tag_name(prev)
-
-    def handle_tag_name(self, tag):
-        match tag.attrs:
-            case {"id": id_name}:
-                name = id_name
-                return f"{name}"
-            case {"class": class_name}:
-                name = "-".join(class_name)
-                return f"{name}"
-            case _:
-                name = str(tag.name).lower().split(".")[-1]
-                return f"{name}"
-
-    def if_children_make_nodes(self) -> list:
-        if self.check(TagCategory.START_CHILDREN):
-            children = self.make_children()
-            return children
-
-        return []
-
-    def make_children(self) -> list[NodeGodot]:
-        children = []
-
-        self.consume(TagCategory.START_CHILDREN, "Should be some children around here")
-
-        while not self.check(TagCategory.END_CHILDREN) and not self.is_at_end():
-            children.append(self.make_node())
-
-        self.consume(TagCategory.END_CHILDREN, "Start of children need END OF CHILDREN")
-        return children
+        # worked out by the scanner, see tag_node_name
+        return self.previous().node_name
 
     def apply_class_options_to_node(self, tk_node: TokenNode) -> None:
         match tk_node.token.name:
@@ -552,11 +593,8 @@ class Parser:
             case TagCategory.LI:
                 tk_node.node.type = "VBoxContainer"
             case _:
-                # this should be a logger.DEBUG kinda thing
-                print(
-                    "apply_class_options_to_node not implemented yet for",
-                    tk_node.token.name,
-                )
+                # nothing class specific for the other tags yet
+                pass
 
     def apply_div_class_options(self, tk_node: TokenNode) -> None:
         match name := tk_node.node.name:
@@ -616,7 +654,7 @@ class Parser:
         tk_node.node = HBoxContainer(tk_node.node.name, properties=properties)
 
     def apply_style_to_node(self, tk_node: TokenNode) -> None:
-        if style_dict := self.tag_style_to_dict(tk_node.token.attrs):
+        if style_dict := tk_node.token.style:
             match style_dict:
                 case {"display": "flex", "flex-direction": "column"}:
                     tk_node.node.type = "VBoxContainer"
@@ -628,40 +666,28 @@ class Parser:
                     pass
 
     def apply_font_style_to_node(self, tk_node: TokenNode) -> None:
-        try:
-            style_dict = self.style_ctx[-1]
-            style_dict.update(self.tag_style_to_dict(tk_node.token.attrs))
-        except IndexError:
-            style_dict = self.tag_style_to_dict(tk_node.token.attrs)
-
-        if style_dict:
-            # handle font type here
-            match style_dict:
-                case {"font-family": font}:
-                    tk_node.node.apply_font_family(font)
-
-            match style_dict:
-                case {"font-size": fontsize}:
-                    match convert_css_value_to_godot(fontsize):
-                        # cheating since we have only px font sizes
-                        # case ("script", _ as val):
-                        #     frag = self.render_margin_fragment(k, val)
-                        #     fragments.extend(frag)
-                        #     del self.theme_properties[k]
-                        case ("int", _ as val):
-                            tk_node.node.apply_font_size(val)
-
-    def tag_style_to_dict(self, tag):
-        styled = {}
-        if styles := tag.get("style"):
-            for s in styles.strip().split(";"):
-                try:
-                    k, v = s.split(": ")
-                    styled[k] = v
-                except ValueError:
-                    pass
-
-        return styled
+        # the node's own style wins, otherwise whatever it inherits
+        own_style = tk_node.token.style
+        font = own_style.get("font-family") or self.style.get("font-family")
+        fontsize = own_style.get("font-size") or self.style.get("font-size")
+        # always worked out here, the closer's margin_node needs it too
+        computed_size = self.font_size(tk_node)
+
+        # handle font type here
+        if font:
+            tk_node.node.apply_font_family(font)
+
+        if fontsize:
+            # em/%/rem all end up in px, godot font sizes are whole numbers
+            tk_node.node.apply_font_size(round(computed_size))
+
+    def font_size(self, tk_node: TokenNode) -> float:
+        # first asked for by the opener, while self.style is still the
+        # parent's, the closer (already inside the tag) gets the same answer
+        if tk_node.font_size is None:
+            own = tk_node.token.style.get("font-size")
+            tk_node.font_size = resolve_font_size(own, self.style.font_size())
+        return tk_node.font_size
 
     def match(self, *token_types: TagCategory) -> bool:
         for _type in token_types:
@@ -678,68 +704,90 @@ class Parser:
 
     # will need to figure out what we're checking
     def check(self, token_type: TagCategory) -> bool:
-        if self.is_at_end():
+        kind = self.tokens.peek_kind()
+        if kind == TagCategory.EOF:
             return False
 
-        return self.peek().name == token_type
+        return kind == token_type
 
     def advance(self) -> Token:
-        if not self.is_at_end():
-            self.current += 1
-
-        return self.previous()
+        return self.tokens.advance()
 
     def is_at_end(self) -> bool:
-        match self.peek().name:
-            case TagCategory.EOF:
-                return True
-            case _:
-                return False
+        return self.tokens.peek_kind() == TagCategory.EOF
 
     def peek(self) -> Token:
-        return self.tokens[self.current]
+        return self.tokens.peek()
 
     def previous(self) -> Token:
-        return self.tokens[self.current - 1]
-
-    def previous_n(self, n) -> Token:
-        return self.tokens[self.current - n]
-
-
-# this may be used in other css values than just padding
-def convert_css_value_to_godot(value) -> tuple:
-    if "px" in value:
-        return ("int", int(value[:-2]))
-    if "%" in value:
-        calc = int(value[:-1]) * 0.01
-        return ("int", calc)
-    if "vh" in value:
-        calc = int(value[:-2]) * 0.01
-        pad_str = f"{calc} * get_viewport().get_visible_rect().size.x"
-        return ("script", pad_str)
-    if "vw" in value:
-        calc = int(value[:-2]) * 0.01
-        pad_str = f"{calc} * get_viewport().get_visible_rect().size.y"
-        return ("script", pad_str)
-    if "auto" in value:
-        return ("str", "auto value")
-    if "rem" in value:
-        # rem is relative to size of root element font
-        # 1rem = the font size of the html element
-        # for now we will cheat and say it's 16px
-        multiplier = int(value[:-3])
-        fontsize = 16
-        calc = multiplier * fontsize
-        return ("int", calc)
-    if "em" in value:
-        # em is relative to font size of element
-        # 1em = whatever the size is, 2em = twice the size
-        # if no fontsize is defined, then default is 16px
-        # may need to figure out how to handle changes in fontsize later
-
-        multiplier = int(value[:-2])
-        fontsize = 16
-        calc = multiplier * fontsize
-        return ("int", calc)
-
-    return ("int", int(value))
+        return self.tokens.previous()
+
+
+FLOW_HANDLERS = (Parser.open_flow, Parser.close_flow)
+
+
+def split_spans(tokens: TokenStream, parts: int) -> list[tuple[int, int]]:
+    # group the top level subtrees into at most `parts` runs of about
+    # the same number of tokens, keeping them in document order
+    spans = list(tokens.top_level_spans())
+    if not spans:
+        return []
+
+    target = spans[-1][1] / parts
+    runs = []
+    run_start = spans[0][0]
+
+    for _, stop in spans:
+        if stop - run_start >= target:
+            runs.append((run_start, stop))
+            run_start = stop
+
+    if run_start < spans[-1][1]:
+        runs.append((run_start, spans[-1][1]))
+
+    return runs
+
+
+def parse_span(tokens: TokenStream, root_name: str, root_type: str, timed: bool):
+    # runs in a worker process, links still want to put their functions on
+    # the root's script so give them a stand in root and hand that script back
+    stand_in = NodeGodot(root_name, root_type)
+    stats = HandlerStats() if timed else None
+    nodes = Parser(tokens, root_node=stand_in, stats=stats).parse()
+
+    return nodes, stand_in.script, stats
+
+
+def parse_parallel(
+    tokens: TokenStream, root_node: NodeGodot, executor, parts: int, stats=None
+) -> list[NodeGodot]:
+    # top level siblings don't share any parser state (they all inherit from
+    # the same empty StyleContext) so each run of them can be parsed on its own
+    runs = split_spans(tokens, parts)
+    if len(runs) < 2:
+        return Parser(tokens, root_node=root_node, stats=stats).parse()
+
+    futures = [
+        executor.submit(
+            parse_span,
+            tokens.slice(start, stop),
+            root_node.name,
+            root_node.type,
+            stats is not None,
+        )
+        for start, stop in runs
+    ]
+
+    nodes = []
+    for future in futures:
+        run_nodes, script, run_stats = future.result()
+        nodes.extend(run_nodes)
+
+        if run_stats:
+            stats.update(run_stats)
+
+        # same order the functions would have been added in one parser
+        if script:
+            root_node.add_script(script.resource)
+
+    return nodes
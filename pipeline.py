@@ -0,0 +1,366 @@
+import io
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Callable
+
+from bs4 import BeautifulSoup
+from lxml import etree
+import css_inline
+
+from artifact_cache import ArtifactCache, stage_key
+from css_engine import Bs4Tree, LxmlTree, page_styles
+from handler_stats import HandlerStats
+from manifest import hash_bytes, hash_file, linked_stylesheets, source_version
+from manifest import template_hashes
+from scanner import HtmlScanner, LxmlScanner
+from node_parser import Parser, parse_parallel
+from render_godot import SceneWriter, make_env, write_files
+
+from godot import NodeGodot, SceneGodot
+from tag_token import TokenStream
+
+import tag_plugins  # registers the extra tags with the scanner and parser
+
+try:
+    CSS_INLINE_VERSION = version("css-inline")
+except PackageNotFoundError:
+    CSS_INLINE_VERSION = "unknown"
+
+PROFILE_SOURCES = ("page_content.py", "generate_main.py", "generate_home_content.py")
+PLUGIN_SOURCES = ("tag_plugins.py",)
+
+
+@dataclass
+class PageProfile:
+    # how one kind of page gets turned into a scene
+    # generate_main, generate_home_content and page_content each define one
+    name: str
+    root_name: str
+    root_type: str
+    # where the scene goes, relative to the output dir: (directory, file stem)
+    output: Callable[[Path], tuple[Path, str]]
+    root_properties: dict = field(default_factory=dict)
+    # pulled out of the soup before scanning, "#thing" means an id
+    # otherwise it's the first tag with that name
+    strip: tuple[str, ...] = ()
+    # id of the element to scan from, None scans the whole <html>
+    scan_root: str = None
+    # hook for attaching scripts etc to the root before parsing
+    setup_root: Callable[[NodeGodot], None] = None
+
+
+def find_selector(soup, selector: str):
+    if selector.startswith("#"):
+        return soup.find(id=selector[1:])
+    return soup.find(selector)
+
+
+def find_lxml_selector(root, selector: str, skip=()):
+    # first match that isn't inside something we already stripped out
+    if selector.startswith("#"):
+        found = root.xpath(".//*[@id=$id]", id=selector[1:])
+    else:
+        found = root.xpath(f".//{selector}")
+
+    for tag in found:
+        if tag not in skip and not any(a in skip for a in tag.iterancestors()):
+            return tag
+
+    return None
+
+
+SCANNERS = ("bs4", "lxml")
+# compiled works each tag's style out from the stylesheets while scanning,
+# inline has css_inline write it into every style attribute first
+CSS_MODES = ("compiled", "inline")
+
+
+def truncated(parser: etree.HTMLParser) -> bool:
+    # libxml2 doesn't fail on a page nested deeper than it allows, it logs a
+    # resource limit error and quietly drops everything below that depth
+    return any(
+        error.type == etree.ErrorTypes.ERR_RESOURCE_LIMIT for error in parser.error_log
+    )
+
+
+class SitePipeline:
+    # everything that is expensive to set up lives here
+    # so it gets built once per process instead of once per page
+    #
+    # a page goes inline -> scan -> parse -> render, with a cache every
+    # stage is keyed on the previous stage's key plus its own code/config
+    # so e.g. a template change only re-renders cached trees
+    def __init__(
+        self,
+        output_dir="godot_output",
+        cache: ArtifactCache = None,
+        scanner="bs4",
+        parse_jobs=1,
+        handler_stats=False,
+        css="compiled",
+        jinja=False,
+    ) -> None:
+        if scanner not in SCANNERS:
+            raise ValueError(f"unknown scanner {scanner}, pick one of {SCANNERS}")
+        if css not in CSS_MODES:
+            raise ValueError(f"unknown css mode {css}, pick one of {CSS_MODES}")
+
+        self.output_dir = Path(output_dir)
+        self.inliner = css_inline.CSSInliner()
+        # huge_tree lets libxml2 nest 2048 deep instead of 256, see make_tree
+        self.html_parser = etree.HTMLParser(huge_tree=True)
+        self.cache = cache
+        self.scanner = scanner
+        self.css = css
+        # render scenes through templates/scene.tscn.j2 instead of write_scene
+        self.jinja = jinja
+        # compiled templates go next to the other cached artifacts
+        self.env = make_env(cache.directory / "jinja" if cache else None)
+        # >1 parses the top level sections of a page in that many processes
+        self.parse_jobs = parse_jobs
+        self._parse_executor = None
+        # call counts/times of every scanner and parser handler
+        self.stats = HandlerStats() if handler_stats else None
+
+    def inline(self, src: Path, raw: bytes = None) -> str:
+        # raw is the page if it was already read, the async build does that
+        if raw is None:
+            with open(src, "r", encoding="utf-8") as f:
+                html = f.read()
+        else:
+            # decoded the same way reading it in text mode does
+            html = io.TextIOWrapper(io.BytesIO(raw), encoding="utf-8").read()
+
+        if self.css == "compiled":
+            # the scanner takes care of it
+            return html
+
+        return self.inliner.inline(html)
+
+    def make_soup(
+        self, profile: PageProfile, inlined: str, src: Path, compiled: bool = None
+    ):
+        soup = BeautifulSoup(inlined, features="lxml")
+        styles = None
+
+        if compiled is None:
+            compiled = self.css == "compiled"
+
+        if compiled:
+            styles, sheet_tags = page_styles(Bs4Tree, soup, src)
+            if styles.unsupported:
+                # css_inline knows selectors we don't, so it does the page
+                inlined = self.inliner.inline(inlined)
+                return self.make_soup(profile, inlined, src, compiled=False)
+            if styles.uses_siblings:
+                # extracting tags changes who is next to who,
+                # css_inline saw the page before any of that happened
+                styles.warm(soup.html)
+            # css_inline drops these too
+            for tag in sheet_tags:
+                tag.extract()
+
+        for selector in profile.strip:
+            if tag := find_selector(soup.html, selector):
+                tag.extract()
+
+        if profile.scan_root:
+            return soup.html.body.find(id=profile.scan_root), styles
+
+        return soup.html, styles
+
+    def make_tree(
+        self, profile: PageProfile, inlined: str, src: Path, compiled: bool = None
+    ):
+        # None if lxml can't give us the whole page
+        root = etree.fromstring(inlined, self.html_parser)
+        if truncated(self.html_parser):
+            print(
+                f"{src}: nested too deep for lxml, scanning it with bs4 instead",
+                file=sys.stderr,
+            )
+            return None
+
+        styles = None
+
+        # no extract() here, the scanner steps over these instead
+        skip = []
+        if compiled is None:
+            compiled = self.css == "compiled"
+
+        if compiled:
+            styles, skip = page_styles(LxmlTree, root, src)
+            if styles.unsupported:
+                # same as make_soup
+                inlined = self.inliner.inline(inlined)
+                return self.make_tree(profile, inlined, src, compiled=False)
+
+        for selector in profile.strip:
+            tag = find_lxml_selector(root, selector, skip)
+            if tag is not None:
+                skip.append(tag)
+
+        if profile.scan_root:
+            body = root.find("body")
+            scan_root = find_lxml_selector(body, f"#{profile.scan_root}", skip)
+            return scan_root, skip, styles
+
+        return root, skip, styles
+
+    def make_scanner(self, profile: PageProfile, inlined: str, src: Path):
+        if self.scanner == "lxml":
+            if tree := self.make_tree(profile, inlined, src):
+                source, skip, styles = tree
+                return LxmlScanner(source, skip, stats=self.stats, styles=styles)
+
+        source, styles = self.make_soup(profile, inlined, src)
+        return HtmlScanner(source, stats=self.stats, styles=styles)
+
+    def scan(self, profile: PageProfile, inlined: str, src: Path) -> TokenStream:
+        return self.make_scanner(profile, inlined, src).scan_tokens()
+
+    def iter_scan(self, profile: PageProfile, inlined: str, src: Path):
+        return self.make_scanner(profile, inlined, src).iter_tokens()
+
+    def make_root(self, profile: PageProfile) -> NodeGodot:
+        root_node = NodeGodot(
+            profile.root_name,
+            profile.root_type,
+            properties=dict(profile.root_properties),
+        )
+
+        if profile.setup_root:
+            profile.setup_root(root_node)
+
+        return root_node
+
+    def parse(self, profile: PageProfile, tokens) -> NodeGodot:
+        root_node = self.make_root(profile)
+
+        if self.parse_jobs > 1 and isinstance(tokens, TokenStream):
+            nodes = parse_parallel(
+                tokens, root_node, self.parse_executor(), self.parse_jobs, self.stats
+            )
+        else:
+            parser = Parser(tokens, root_node=root_node, stats=self.stats)
+            nodes = parser.parse()
+
+        for child in nodes:
+            root_node.add_child(child)
+
+        return root_node
+
+    def parse_executor(self) -> ProcessPoolExecutor:
+        if self._parse_executor is None:
+            self._parse_executor = ProcessPoolExecutor(self.parse_jobs)
+        return self._parse_executor
+
+    def close(self) -> None:
+        if self._parse_executor:
+            self._parse_executor.shutdown()
+            self._parse_executor = None
+
+    def render(self, profile: PageProfile, src: Path, root_node) -> dict[Path, str]:
+        out_dir, out_fname = profile.output(src)
+        scene = SceneGodot(root_node, path=(out_dir / out_fname).as_posix())
+        writer = SceneWriter(
+            scene, self.output_dir, out_fname, jinja=self.jinja, env=self.env
+        )
+        return writer.rendered_files()
+
+    def stage_keys(
+        self, profile: PageProfile, src: Path, raw: bytes = None
+    ) -> dict[str, str]:
+        if raw is None:
+            with open(src, "rb") as f:
+                raw = f.read()
+
+        sheets = [
+            hash_file(sheet)
+            for sheet in linked_stylesheets(src, raw.decode("utf-8", errors="replace"))
+        ]
+
+        keys = {}
+        keys["inline"] = stage_key(
+            hash_bytes(raw), sheets, self.css, CSS_INLINE_VERSION
+        )
+        keys["scan"] = stage_key(
+            keys["inline"],
+            profile.strip,
+            profile.scan_root,
+            self.scanner,
+            source_version(
+                "tag_token.py",
+                "scanner.py",
+                "css_engine.py",
+                "pipeline.py",
+                *PLUGIN_SOURCES,
+            ),
+        )
+        keys["parse"] = stage_key(
+            keys["scan"],
+            profile.root_name,
+            profile.root_type,
+            profile.root_properties,
+            source_version(
+                "node_parser.py",
+                "style_context.py",
+                "css_units.py",
+                "godot.py",
+                *PROFILE_SOURCES,
+                *PLUGIN_SOURCES,
+            ),
+        )
+        keys["render"] = stage_key(
+            keys["parse"],
+            profile.output(src),
+            self.jinja,
+            template_hashes(),
+            source_version("render_godot.py"),
+        )
+
+        return keys
+
+    def render_page(
+        self, profile: PageProfile, src: Path, raw: bytes = None
+    ) -> dict[Path, str]:
+        # raw is the page's bytes if the caller already read them
+        if not (cache := self.cache):
+            # nothing to keep, so stream the tokens straight into the parser
+            # unless it's going to split them up, that needs the whole stream
+            if self.parse_jobs > 1:
+                tokens = self.scan(profile, self.inline(src, raw), src)
+            else:
+                tokens = self.iter_scan(profile, self.inline(src, raw), src)
+            return self.render(profile, src, self.parse(profile, tokens))
+
+        keys = self.stage_keys(profile, src, raw)
+
+        # only pull in the earlier stages if the later ones missed
+        def inlined():
+            return cache.cached(
+                "inline", keys["inline"], lambda: self.inline(src, raw)
+            )
+
+        def tokens():
+            return cache.cached(
+                "scan", keys["scan"], lambda: self.scan(profile, inlined(), src)
+            )
+
+        def root_node():
+            return cache.cached(
+                "parse", keys["parse"], lambda: self.parse(profile, tokens())
+            )
+
+        return cache.cached(
+            "render", keys["render"], lambda: self.render(profile, src, root_node())
+        )
+
+    def build_page(self, profile: PageProfile, src: Path) -> dict[Path, bool]:
+        # output path -> whether it changed, see write_files
+        out_dir, _ = profile.output(src)
+        return write_files(self.output_dir / out_dir, self.render_page(profile, src))
@@ -6,11 +6,8 @@
 #     & C:/Users/choosegoose/.virtualenvs/html_to_tscn-UVkTTcz6/Scripts/python.exe c:/code/html_to_tscn/page_content.py --src $_.FullName
 # }
 
-# generate main navbar/footer
-& C:/Users/choosegoose/.virtualenvs/html_to_tscn-UVkTTcz6/Scripts/python.exe c:/code/html_to_tscn/generate_main.py
-
-# generate content of main
-& C:/Users/choosegoose/.virtualenvs/html_to_tscn-UVkTTcz6/Scripts/python.exe c:/code/html_to_tscn/generate_home_content.py --src '.\src_html\wizard woes.html'
+# generate main navbar/footer, content of main and every glas page in one go
+& C:/Users/choosegoose/.virtualenvs/html_to_tscn-UVkTTcz6/Scripts/python.exe c:/code/html_to_tscn/build_site.py --src .\src_html --outdir .\godot_output
 
 # Copy-Item -r -Force .\godot_output\* C:\code\godot-projects\wizardwoes 
 # Copy-Item -r -force C:\code\godot-projects\wizardwoes\glas\glas\* C:\code\godot-projects\wizardwoes\glas
@@ -1,18 +1,86 @@
+import filecmp
+import io
+import os
+import tempfile
+
 from dataclasses import dataclass
-from jinja2 import Environment, PackageLoader, select_autoescape
+from functools import cache, cached_property
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+from jinja2 import select_autoescape
+from pathlib import Path
+from typing import Callable, TextIO
 
+from manifest import TEMPLATE_DIR
 
-env = Environment(
-    loader=PackageLoader("godot"),
-    autoescape=select_autoescape(),
-    trim_blocks=True,
-    lstrip_blocks=True,
-)
 
+@cache
+def make_env(bytecode_dir=None) -> Environment:
+    # one per process (and bytecode dir), templates are loaded straight from
+    # the directory and the compiled ones kept in bytecode_dir between runs,
+    # keyed on the template's source so an edited one just gets recompiled
+    bytecode_cache = None
+    if bytecode_dir:
+        Path(bytecode_dir).mkdir(parents=True, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(str(bytecode_dir))
+
+    return Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        bytecode_cache=bytecode_cache,
+        autoescape=select_autoescape(),
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+
+
+env = make_env()
+
+
+from godot import THEME_OVERRIDES, NodeGodot, SceneGodot, GDScriptResource, godot_value
+
+
+def write_scene(scene: SceneGodot, out) -> None:
+    # the same text scene.tscn.j2 renders, streamed into out in one go over
+    # the nodes with every value formatted just the once
+    fd = scene.fd
+    out.write("\n" * 5)
+    out.write(
+        f"[{fd.resource_type} load_steps={fd.load_steps} format=3"
+        f' uid="uid://{fd.uid}"]\n\n'
+    )
+
+    for resource in scene.ext_resources:
+        out.write(f"{resource.header}\n")
+    out.write("\n")
+
+    for node in scene.flat_nodes():
+        write_node(node, out)
+
+    out.write("\n")
 
-from pathlib import Path
 
-from godot import NodeGodot, SceneGodot, GDScriptResource
+def write_node(node: NodeGodot, out) -> None:
+    parent_path = node.parent_path_str
+    parent = f'parent="{parent_path}"' if parent_path else ""
+    lines = [f'[{node.resource_type} name="{node.name}" type="{node.type}" {parent}]']
+
+    for key, value in node.properties.items():
+        lines.append(f"{key} = {godot_value(value)}")
+
+    for key, value in node.theme_properties.items():
+        if value is not None and (override := THEME_OVERRIDES.get(key)):
+            lines.append(f"{override} = {godot_value(value)}")
+
+    if node.resources:
+        for resource in node.resources:
+            lines.append(f'{resource.type.lower()} = ExtResource("{resource.id}")')
+        # the template leaves a blank line after them
+        lines.append("")
+
+    if script := node.script:
+        lines.append(f'{script.type.lower()} = ExtResource("{script.id}")')
+
+    lines.append("\n")
+    out.write("\n".join(lines))
 
 
 @dataclass
@@ -20,46 +88,173 @@ class SceneWriter:
     scene: SceneGodot
     output_dir: str
     out_fname: Path = Path("test.tscn")
+    # go through templates/scene.tscn.j2 instead of write_scene,
+    # slower but the output can be changed without touching any code
+    jinja: bool = False
+    env: Environment = env
+
+    # looked up once per writer instead of once per scene/script
+    @cached_property
+    def scene_template(self) -> Template:
+        return self.env.get_template("scene.tscn.j2")
+
+    @cached_property
+    def script_template(self) -> Template:
+        return self.env.get_template("gdscript.gd.j2")
 
     def render_scene(self) -> str:
+        if not self.jinja:
+            out = io.StringIO()
+            write_scene(self.scene, out)
+            return out.getvalue()
+
         nodes = self.scene.flat_nodes()
-        template = env.get_template("scene.tscn.j2")
-        return template.render(
+        return self.scene_template.render(
             fd=self.scene.fd,
             ext_resource=self.scene.ext_resources,
             nodes=nodes,
         )
 
     def render_script_resource(self, script) -> str:
-        script_template = env.get_template("gdscript.gd.j2")
-        return script_template.render(script=script)
+        return self.script_template.render(script=script)
 
-    def write_out_scene(self) -> None:
-        rendered = self.render_scene()
+    def rendered_files(self) -> dict[Path, str]:
+        # everything this scene turns into, file name -> contents
+        files = {Path(f"{self.out_fname}.tscn"): self.render_scene() + "\n"}
 
-        outdir = Path(self.output_dir)
-        outdir.mkdir(exist_ok=True)
+        for resource in self.scene.ext_resources:
+            match resource.resource:
+                case GDScriptResource() as script:
+                    outfile = Path(f"{resource.path}.gd")
+                    files[outfile] = self.render_script_resource(script)
+                case _:
+                    # fonts and images are already in the godot project
+                    pass
+
+        return files
+
+    def write_out_scene(self) -> Path:
+        outfile = Path(self.output_dir) / f"{self.out_fname}.tscn"
+        if self.jinja:
+            write_if_changed(outfile, self.render_scene() + "\n")
+        else:
+            # straight into the file, the scene is never one big string
+            write_streamed(outfile, self.stream_scene)
+        return outfile
 
-        print(f"Write it out to {self.out_fname}")
-        outfile_with_extension = Path(f"{self.out_fname}.tscn")
-        with open(outdir / outfile_with_extension, "w", encoding="utf-8") as f:
-            f.write(rendered)
-            f.write("\n")
+    def stream_scene(self, out) -> None:
+        # what rendered_files has for the scene
+        write_scene(self.scene, out)
+        out.write("\n")
 
-    def write_out_resources(self):
+    def write_out_resources(self) -> list[Path]:
         outdir = Path(self.output_dir)
-        outdir.mkdir(exist_ok=True)
+        written = []
 
         for resource in self.scene.ext_resources:
             match resource.resource:
                 case GDScriptResource() as script:
-                    renderable = self.render_script_resource(script)
-                    outfile = Path(f"{resource.path}.gd")
-                    with open(outdir / outfile, "w", encoding="utf-8") as f:
-                        f.write(renderable)
-                    print(f"Write it out to {Path(outdir / outfile)}")
+                    outfile = outdir / f"{resource.path}.gd"
+                    write_if_changed(outfile, self.render_script_resource(script))
+                    written.append(outfile)
                 case _:
-                    print("we dont write to file", resource.resource)
+                    # fonts and images are already in the godot project
+                    pass
+
+        return written
+
+
+# mkstemp makes files only we can read,
+# outputs get the mode open() would have given them
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+def write_if_changed(path: Path, contents: str) -> bool:
+    # a file that already says the same thing is left alone, mtime and all,
+    # so godot doesn't reimport it. a changed one is written next to it and
+    # renamed over it so nothing ever sees half a file. returns if it wrote
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == contents:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(contents)
+        os.chmod(tmp, FILE_MODE)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    return True
+
+
+def write_streamed(path: Path, write: Callable[[TextIO], None]) -> bool:
+    # write_if_changed for output made a bit at a time, write(f) streams it
+    # into the temp file and that only replaces path if it came out different
+    # (compared a block at a time, neither is ever read in whole)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            write(f)
+
+        changed = not (path.is_file() and filecmp.cmp(tmp, path, shallow=False))
+        if changed:
+            os.chmod(tmp, FILE_MODE)
+            os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+    return changed
+
+
+def write_files(output_dir, files: dict[Path, str]) -> dict[Path, bool]:
+    # output path -> whether it actually had to be written
+    outdir = Path(output_dir)
+    return {
+        outdir / fname: write_if_changed(outdir / fname, contents)
+        for fname, contents in files.items()
+    }
+
+
+def remove_files(paths, output_dir) -> int:
+    # outputs nothing makes any more, and any directories that leaves empty
+    outdir = Path(output_dir).resolve()
+    removed = 0
+
+    for path in map(Path, paths):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        removed += 1
+
+        parent = path.parent.resolve()
+        while outdir in parent.parents:
+            try:
+                parent.rmdir()
+            except OSError:
+                # not empty
+                break
+            parent = parent.parent
+
+    return removed
+
+
+def format_writes(outputs: dict[Path, bool], removed: int = 0) -> str:
+    # outputs like write_files returns them
+    written = sum(outputs.values())
+    unchanged = len(outputs) - written
+    return f"output: {written} written, {unchanged} unchanged, {removed} removed"
 
 
 # if __name__ == "__main__":
@@ -1,13 +1,74 @@
-from tag_token import Token, TagCategory
-from bs4 import NavigableString
+from time import perf_counter
+
+from handler_stats import HandlerStats
+from tag_token import STRUCTURE_CATEGORIES, Token, TagCategory, TokenStream
+from bs4 import NavigableString, Tag
+from lxml import etree
+
+# tag name -> token kind, anything not in here is FLOW
+TAG_CATEGORIES = {
+    "h1": TagCategory.H1,
+    "h4": TagCategory.H4,
+    "p": TagCategory.P,
+    "title": TagCategory.TITLE,
+    "a": TagCategory.A,
+    "em": TagCategory.EM,
+    "i": TagCategory.I,
+    "hr": TagCategory.HR,
+    "meta": TagCategory.METADATA,
+    "div": TagCategory.DIV,
+    "span": TagCategory.SPAN,
+    "body": TagCategory.BODY,
+    "footer": TagCategory.FOOTER,
+    "head": TagCategory.HEAD,
+    "img": TagCategory.IMG,
+    "nav": TagCategory.NAV,
+    "ul": TagCategory.UL,
+    "li": TagCategory.LI,
+    "blockquote": TagCategory.BLOCKQUOTE,
+}
+
+# these take their text with them, the next element gets eaten
+STRING_TAGS = {"h1", "h4", "em", "span"}
+
+
+def register_tag(name: str, kind: TagCategory, string=False) -> None:
+    # for plugins, see tag_plugins.py
+    TAG_CATEGORIES[name] = kind
+    if string:
+        STRING_TAGS.add(name)
+    else:
+        STRING_TAGS.discard(name)
+
+
+# bs4 squashes whitespace-only strings outside of these into "\n" or " "
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+# attributes bs4 splits into lists, so both scanners hand the parser the same thing
+MULTI_VALUED_ATTRIBUTES = {
+    "*": {"class", "accesskey", "dropzone"},
+    "a": {"rel", "rev"},
+    "link": {"rel", "rev"},
+    "area": {"rel"},
+    "td": {"headers"},
+    "th": {"headers"},
+}
 
 
 class HtmlScanner:
-    def __init__(self, source) -> None:
+    # pass a HandlerStats to count and time every tag scanned, by kind
+    # and a css_engine.PageStyles to take each tag's style from the
+    # compiled stylesheets instead of its (inlined) style attribute
+    def __init__(self, source, stats: HandlerStats = None, styles=None) -> None:
         self.source = source
+        self.stats = stats
+        self.styles = styles
+        # tokens scanned but not handed out by iter_tokens yet
         self.tokens = []
         self.current_tag = source
         self.scope = []
+        self.last_node_name = ""
 
     def _is_at_end(self) -> bool:
         if self.current_tag.next_element:
@@ -28,15 +89,37 @@ class HtmlScanner:
         self.current_tag = self.current_tag.next_element
 
     def add_token(self, token: Token) -> None:
+        # START/END_CHILDREN don't make nodes, a node made while one of them is
+        # the previous token is named after the last real token before it
+        if token.name in STRUCTURE_CATEGORIES:
+            token.node_name = self.last_node_name
+        else:
+            self.last_node_name = token.node_name
+
         self.tokens.append(token)
 
-    def scan_tokens(self) -> list[Token]:
+    def _drain(self) -> list[Token]:
+        tokens, self.tokens = self.tokens, []
+        return tokens
+
+    def style_of(self, tag):
+        # None leaves it to Token to parse the style attribute
+        if self.styles is None:
+            return None
+        return self.styles.style_of(tag)
+
+    def iter_tokens(self):
+        # a generator so the parser can build nodes while we're still scanning
         while not self._is_at_end():
             self.scan_token()
+            yield from self._drain()
 
+        self.close_scopes(None)
         self.add_token(Token(TagCategory.EOF))
+        yield from self._drain()
 
-        return self.tokens
+    def scan_tokens(self) -> TokenStream:
+        return TokenStream(self.iter_tokens())
 
     def clean_string(self, text):
         fmt = [ts.strip() for ts in text.split("\n")]
@@ -53,90 +136,219 @@ class HtmlScanner:
                     self.add_token(Token(TagCategory.TEXT, cleaned))
 
             case _ as tag:
-                match tag.name:
-                    case "h1":
-                        next_str = self.clean_string(self.peek().string)
-                        self.add_token(
-                            Token(
-                                TagCategory.H1,
-                                str_val=next_str,
-                                attrs=tag.attrs,
-                            )
-                        )
-                        self._advance()
-                    case "h4":
-                        next_str = self.clean_string(self.peek().string)
-                        self.add_token(
-                            Token(
-                                TagCategory.H4,
-                                str_val=next_str,
-                                attrs=tag.attrs,
-                            )
-                        )
-                        self._advance()
-                    case "p":
-                        self.add_token(Token(TagCategory.P, attrs=tag.attrs))
-                    case "title":
-                        self.add_token(Token(TagCategory.TITLE, attrs=tag.attrs))
-                    case "a":
-                        self.add_token(Token(TagCategory.A, attrs=tag.attrs))
-                    case "em":
-                        next_str = self.clean_string(self.peek().string)
-                        self.add_token(
-                            Token(
-                                TagCategory.EM,
-                                str_val=next_str,
-                                attrs=tag.attrs,
-                            )
-                        )
-                        self._advance()
-                    case "i":
-                        self.add_token(Token(TagCategory.I, attrs=tag.attrs))
-                    case "hr":
-                        self.add_token(Token(TagCategory.HR, attrs=tag.attrs))
-                    case "meta":
-                        self.add_token(Token(TagCategory.METADATA, attrs=tag.attrs))
-                    case "div":
-                        self.add_token(Token(TagCategory.DIV, attrs=tag.attrs))
-                    case "span":
-                        next_str = self.clean_string(self.peek().string)
-                        self.add_token(
-                            Token(
-                                TagCategory.SPAN,
-                                str_val=next_str,
-                                attrs=tag.attrs,
-                            )
-                        )
-                        self._advance()
-                    case "body":
-                        self.add_token(Token(TagCategory.BODY, attrs=tag.attrs))
-                    case "footer":
-                        self.add_token(Token(TagCategory.FOOTER, attrs=tag.attrs))
-                    case "head":
-                        self.add_token(Token(TagCategory.HEAD, attrs=tag.attrs))
-                    case "img":
-                        self.add_token(Token(TagCategory.IMG, attrs=tag.attrs))
-                    case "nav":
-                        self.add_token(Token(TagCategory.NAV, attrs=tag.attrs))
-                    case "ul":
-                        self.add_token(Token(TagCategory.UL, attrs=tag.attrs))
-                    case "li":
-                        self.add_token(Token(TagCategory.LI, attrs=tag.attrs))
-                    case "blockquote":
-                        self.add_token(Token(TagCategory.BLOCKQUOTE, attrs=tag.attrs))
-                    case _:
-                        self.add_token(Token(TagCategory.FLOW, attrs=tag.attrs))
-
-        try:
-            if list(self.peek().children):
-                self.add_token(Token(TagCategory.START_CHILDREN, self.peek().name))
-                self.scope.append(self.peek())
-        except AttributeError:
-            pass
-
-        try:
-            while self.peek_next() not in self.scope[-1].children:
-                self.add_token(Token(TagCategory.END_CHILDREN, self.scope[-1].name))
-                self.scope.pop()
-        except IndexError:
-            pass
+                if self.stats is None:
+                    self.scan_tag(tag)
+                else:
+                    self.timed(self.scan_tag, tag)
+
+        self.open_scope(self.peek())
+        self.close_scopes(self.peek_next())
+
+    def timed(self, scan, tag) -> None:
+        start = perf_counter()
+        if (kind := scan(tag)) is not None:
+            seconds = perf_counter() - start
+            self.stats.record(f"scan_{kind.name.lower()}", seconds)
+
+    def scan_tag(self, tag) -> TagCategory:
+        # one dict lookup for the kind instead of a match per tag name
+        kind = TAG_CATEGORIES.get(tag.name, TagCategory.FLOW)
+
+        style = self.style_of(tag)
+
+        if tag.name in STRING_TAGS:
+            if (string := tag.string) is not None:
+                next_str = self.clean_string(string)
+                self.add_token(
+                    Token(kind, str_val=next_str, attrs=tag.attrs, style=style)
+                )
+                self._advance()
+                return kind
+            # text mixed with tags (or nothing at all), no one string to take
+            # so it's a container like any tag we don't know
+            kind = TagCategory.FLOW
+
+        self.add_token(Token(kind, attrs=tag.attrs, style=style))
+        return kind
+
+    def open_scope(self, tag) -> None:
+        # contents is a plain list so this is O(1), no need to walk the children
+        if isinstance(tag, Tag) and tag.contents:
+            self.add_token(Token(TagCategory.START_CHILDREN, tag.name))
+            self.scope.append(tag)
+
+    def close_scopes(self, next_tag) -> None:
+        # next_element is document order, so if the next tag isn't a direct
+        # child of the innermost open scope then that scope is done
+        # every scope gets popped exactly once so this is O(1) amortized
+        parent = next_tag.parent if next_tag is not None else None
+
+        while self.scope and self.scope[-1] is not parent:
+            self.add_token(Token(TagCategory.END_CHILDREN, self.scope[-1].name))
+            self.scope.pop()
+
+
+class LxmlScanner:
+    # builds the same token stream as HtmlScanner but straight off an lxml tree
+    # using iterwalk start/end events, no BeautifulSoup object model needed
+    #
+    # skip is the elements HtmlScanner would have had extract()ed,
+    # their tail text is still scanned like bs4 leaves it behind
+    def __init__(
+        self, source, skip=(), stats: HandlerStats = None, styles=None
+    ) -> None:
+        self.source = source
+        self.skip = set(skip)
+        self.stats = stats
+        self.styles = styles
+        self.tokens = []
+        self.scope = []
+        self.last_node_name = ""
+        # first child of a STRING_TAGS element, HtmlScanner advances past it
+        self.consumed = None
+        self.preserve_whitespace = 0
+
+    clean_string = HtmlScanner.clean_string
+    add_token = HtmlScanner.add_token
+    _drain = HtmlScanner._drain
+    style_of = HtmlScanner.style_of
+    scan_tokens = HtmlScanner.scan_tokens
+    timed = HtmlScanner.timed
+
+    def iter_tokens(self):
+        # like HtmlScanner the source itself isn't a token,
+        # and scanning carries on through the rest of the document after it
+        self.scan_text(self.source.text)
+        for child in self.source:
+            yield from self.scan_element(child)
+
+        node = self.source
+        while node is not None:
+            self.scan_text(node.tail)
+            for sibling in node.itersiblings():
+                yield from self.scan_element(sibling)
+            node = node.getparent()
+
+        self.add_token(Token(TagCategory.EOF))
+        yield from self._drain()
+
+    def scan_text(self, text) -> None:
+        if not text:
+            return
+
+        if not self.preserve_whitespace and not text.strip(ASCII_SPACES):
+            if "\n" in text:
+                return
+            text = " "
+
+        if text != "\n":
+            self.add_token(Token(TagCategory.TEXT, self.clean_string(text)))
+
+    def scan_element(self, element):
+        if not isinstance(element.tag, str):
+            # iterwalk only starts from real elements
+            if isinstance(element, etree._Comment):
+                self.scan_text(element.text)
+            self.scan_text(element.tail)
+            yield from self._drain()
+            return
+
+        walker = etree.iterwalk(element, events=("start", "end", "comment", "pi"))
+
+        for event, el in walker:
+            match event:
+                case "start" if el in self.skip:
+                    walker.skip_subtree()
+                case "start":
+                    if el.tag in PRESERVE_WHITESPACE_TAGS:
+                        self.preserve_whitespace += 1
+                    if self.stats is None:
+                        self.scan_start(el)
+                    else:
+                        self.timed(self.scan_start, el)
+                case "end":
+                    if self.scope and self.scope[-1] is el:
+                        self.add_token(Token(TagCategory.END_CHILDREN, el.tag))
+                        self.scope.pop()
+                    if el.tag in PRESERVE_WHITESPACE_TAGS and el not in self.skip:
+                        self.preserve_whitespace -= 1
+                    self.scan_text(el.tail)
+                case "comment":
+                    # bs4 comments are strings too
+                    if el is not self.consumed:
+                        self.scan_text(el.text)
+                    self.scan_text(el.tail)
+                case "pi":
+                    self.scan_text(el.tail)
+
+            yield from self._drain()
+
+    def scan_start(self, el) -> TagCategory:
+        if el is self.consumed:
+            # eaten by the string tag before it, but its children still count
+            self.open_scope(el)
+            return None
+
+        kind = TAG_CATEGORIES.get(el.tag, TagCategory.FLOW)
+        attrs = self.attributes(el)
+        style = self.style_of(el)
+
+        if el.tag in STRING_TAGS:
+            if (string := element_string(el)) is not None:
+                next_str = self.clean_string(string)
+                self.add_token(Token(kind, str_val=next_str, attrs=attrs, style=style))
+
+                if not el.text and len(el):
+                    self.consumed = el[0]
+
+                return kind
+            # same as HtmlScanner.scan_tag
+            kind = TagCategory.FLOW
+
+        self.add_token(Token(kind, attrs=attrs, style=style))
+        self.open_scope(el)
+        return kind
+
+    def open_scope(self, el) -> None:
+        if self.has_contents(el):
+            self.add_token(Token(TagCategory.START_CHILDREN, el.tag))
+            self.scope.append(el)
+
+        self.scan_text(el.text)
+
+    def has_contents(self, el) -> bool:
+        if el.text:
+            return True
+
+        for child in el:
+            if child not in self.skip or child.tail:
+                return True
+
+        return False
+
+    def attributes(self, el) -> dict:
+        attrs = dict(el.attrib)
+
+        for name in MULTI_VALUED_ATTRIBUTES["*"] | MULTI_VALUED_ATTRIBUTES.get(
+            el.tag, set()
+        ):
+            if name in attrs:
+                attrs[name] = attrs[name].split()
+
+        return attrs
+
+
+def element_string(el):
+    # what bs4's Tag.string would be: the text if the element has exactly
+    # one child, recursing through single element children
+    if not len(el):
+        return el.text
+
+    if el.text or len(el) > 1 or el[0].tail:
+        return None
+
+    child = el[0]
+    if isinstance(child, etree._Comment):
+        return child.text
+
+    return element_string(child)
@@ -0,0 +1,73 @@
+from css_units import ROOT_FONT_SIZE, resolve_font_size
+from tag_token import EMPTY_ATTRS
+
+# where font_size() keeps its answer in _cache, can't clash with a css property
+COMPUTED_FONT_SIZE = "computed font-size"
+
+
+class StyleContext:
+    # the styles of every element we're inside of, as a chain back to the root
+    # entering an element is O(1) (nothing gets copied) and each scope
+    # remembers what it looked up, so reading an inherited property is O(1)
+    # once anything under the same ancestor has asked for it
+    #
+    # scopes are never changed after they're made, so siblings can't see
+    # each other's styles
+    __slots__ = ("style", "parent", "_cache")
+
+    def __init__(self, style=EMPTY_ATTRS, parent: "StyleContext" = None) -> None:
+        self.style = style
+        self.parent = parent
+        self._cache = {}
+
+    def child(self, style) -> "StyleContext":
+        # an element without a style inherits everything as is
+        if not style:
+            return self
+
+        return StyleContext(style, self)
+
+    def get(self, name: str):
+        # walk up until someone knows, then remember the answer on every
+        # scope on the way (no recursion, scopes can be nested very deep)
+        path = []
+        scope = self
+        value = None
+
+        while scope is not None:
+            if name in scope._cache:
+                value = scope._cache[name]
+                break
+            if (value := scope.style.get(name)) is not None:
+                break
+
+            path.append(scope)
+            scope = scope.parent
+
+        if scope is not None:
+            scope._cache[name] = value
+        for passed in path:
+            passed._cache[name] = value
+
+        return value
+
+    def font_size(self) -> float:
+        # the computed font size in px, every scope's font-size resolved
+        # against its parent's, so nested em/% sizes compound like in a browser
+        path = []
+        scope = self
+        size = ROOT_FONT_SIZE
+
+        while scope is not None:
+            if (known := scope._cache.get(COMPUTED_FONT_SIZE)) is not None:
+                size = known
+                break
+
+            path.append(scope)
+            scope = scope.parent
+
+        for passed in reversed(path):
+            size = resolve_font_size(passed.style.get("font-size"), size)
+            passed._cache[COMPUTED_FONT_SIZE] = size
+
+        return size
@@ -0,0 +1,65 @@
+from godot import HBoxContainer, NodeGodot, VBoxContainer
+from node_parser import Parser, TokenNode, closes, handles, make_rich_text_label
+from scanner import register_tag
+from tag_token import TagCategory
+
+# tags that aren't part of the core scanner/parser
+# each one is registered with both, importing this module turns them on
+# (pipeline.py does that)
+
+register_tag("h2", TagCategory.H2, string=True)
+register_tag("h3", TagCategory.H3, string=True)
+register_tag("table", TagCategory.TABLE)
+register_tag("tr", TagCategory.TABLE_ROW)
+register_tag("code", TagCategory.CODE, string=True)
+register_tag("pre", TagCategory.PRE)
+
+# same as h1/h4
+handles(TagCategory.H2, TagCategory.H3)(Parser.open_heading)
+closes(TagCategory.H2, TagCategory.H3)(Parser.close_heading)
+
+
+@handles(TagCategory.TABLE)
+def open_table(parser: Parser) -> TokenNode:
+    # rows stacked on top of each other, cells side by side in each row
+    properties = {
+        "layout_mode": 2,
+        "size_flags_horizontal": 3,
+    }
+    node = VBoxContainer(parser.make_name_tag(), properties=properties)
+
+    return TokenNode(parser.previous(), node)
+
+
+@handles(TagCategory.TABLE_ROW)
+def open_table_row(parser: Parser) -> TokenNode:
+    properties = {
+        "layout_mode": 2,
+        "size_flags_horizontal": 3,
+    }
+    node = HBoxContainer(parser.make_name_tag(), properties=properties)
+
+    return TokenNode(parser.previous(), node)
+
+
+closes(TagCategory.TABLE, TagCategory.TABLE_ROW, TagCategory.PRE)(
+    Parser.close_container
+)
+
+
+@handles(TagCategory.CODE)
+def make_code(parser: Parser) -> NodeGodot:
+    text = f"[code]{parser.previous().str_val}[/code]"
+    return make_rich_text_label("text", text)
+
+
+@handles(TagCategory.PRE)
+def open_preformatted(parser: Parser) -> TokenNode:
+    # a block like blockquote, the text inside is whatever its children are
+    node = parser.basic_node()
+
+    tk_node = TokenNode(parser.previous(), node)
+    parser.apply_style_to_node(tk_node)
+    parser.apply_font_style_to_node(tk_node)
+
+    return tk_node
@@ -1,7 +1,13 @@
+import sys
+
+from array import array
 from dataclasses import dataclass, field
-from enum import Enum, auto
+from enum import IntEnum, auto
+from functools import lru_cache
+
 
-class TagCategory(Enum):
+# small ints so a stream of them fits in an array and compares as plain ints
+class TagCategory(IntEnum):
     TEXT = auto()
     FLOW = auto()
     METADATA = auto()
@@ -26,11 +32,293 @@ class TagCategory(Enum):
     FOOTER = auto()
     IMG = auto()
     NAV = auto()
+    # scanned/parsed by tag_plugins.py
+    H2 = auto()
+    H3 = auto()
+    TABLE = auto()
+    TABLE_ROW = auto()
+    CODE = auto()
+    PRE = auto()
     EOF = auto()
 
 
-@dataclass
+STRUCTURE_CATEGORIES = (TagCategory.START_CHILDREN, TagCategory.END_CHILDREN)
+
+# int -> member without going through the enum's lookup
+CATEGORIES_BY_VALUE = {category.value: category for category in TagCategory}
+
+
+@dataclass(slots=True)
 class Token:
     name: TagCategory
     str_val: str = ""
-    attrs: dict = field(default_factory=dict)
\ No newline at end of file
+    attrs: dict = field(default_factory=dict)
+    # what the parser names the node made from this token
+    # START/END_CHILDREN get the name of the token before them from the scanner
+    node_name: str = ""
+    # the style attribute already split up, shared between tokens so hands off
+    style: dict = None
+
+    def __post_init__(self):
+        if not self.node_name and self.name not in STRUCTURE_CATEGORIES:
+            self.node_name = tag_node_name(self.name, self.attrs)
+        if self.style is None:
+            self.style = parse_style(self.attrs.get("style"))
+
+
+def tag_node_name(category: TagCategory, attrs: dict) -> str:
+    match attrs:
+        case {"id": id_name}:
+            name = id_name
+            return f"{name}"
+        case {"class": class_name}:
+            name = "-".join(class_name)
+            return f"{name}"
+        case _:
+            name = CATEGORIES_BY_VALUE[category].name.lower()
+            return f"{name}"
+
+
+class TokenBuffer:
+    # lets the parser read tokens straight off the scanner's generator
+    # only the next token (lookahead) and the one before it are kept around
+    def __init__(self, tokens) -> None:
+        self._tokens = iter(tokens)
+        self._previous = None
+        self._next = next(self._tokens, None) or Token(TagCategory.EOF)
+
+    def peek(self) -> Token:
+        return self._next
+
+    def peek_kind(self) -> int:
+        return self._next.name
+
+    def previous(self) -> Token:
+        return self._previous
+
+    def advance(self) -> Token:
+        if self._next.name != TagCategory.EOF:
+            self._previous = self._next
+            self._next = next(self._tokens, None) or Token(TagCategory.EOF)
+
+        return self._previous
+
+
+class FrozenAttrs(dict):
+    # attrs shared between every token with the same attributes,
+    # so nobody gets to change them
+    __slots__ = ()
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError("token attrs/styles are shared and can't be modified")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = _frozen
+    setdefault = update = __ior__ = _frozen
+
+    def __reduce__(self):
+        return (FrozenAttrs, (dict(self),))
+
+
+EMPTY_ATTRS = FrozenAttrs()
+
+
+@lru_cache(maxsize=4096)
+def parse_style(declarations: str) -> FrozenAttrs:
+    # "color: red;margin:1px" -> {"color": "red", "margin": "1px"}
+    # only splits on the first ":" so urls and the like survive,
+    # declarations without one (or without a value) are skipped
+    if not declarations:
+        return EMPTY_ATTRS
+
+    style = {}
+    for declaration in declarations.split(";"):
+        name, colon, value = declaration.partition(":")
+        name = name.strip().lower()
+        value = value.strip()
+        # the cascade is done by the time a style attribute gets here
+        # (css_inline or css_engine applied it), the flag only gets in the way
+        if value.replace(" ", "").lower().endswith("!important"):
+            value = value[: value.rindex("!")].rstrip()
+
+        if colon and name and value:
+            style[name] = value
+
+    return FrozenAttrs(style) if style else EMPTY_ATTRS
+
+
+def attrs_key(attrs: dict) -> tuple:
+    return tuple(
+        (k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(attrs.items())
+    )
+
+
+class TokenStream:
+    # struct of arrays version of a list[Token]
+    # kinds are small ints in an array, names are interned and identical attrs
+    # (and styles) are one shared FrozenAttrs, so a big page doesn't cost an object (and a
+    # dict) per token. Token objects are only made when the parser asks.
+    def __init__(self, tokens=()) -> None:
+        self.kinds = array("B")
+        self.str_vals = []
+        self.attrs = []
+        self.node_names = []
+        self.styles = []
+        # bracket index: a START_CHILDREN holds the index of its END_CHILDREN
+        # and the other way around, everything else is -1
+        self.ends = array("i")
+        self._attrs_pool = {}
+        self._open = []
+
+        for token in tokens:
+            self.append(token)
+
+    def append(self, token: Token) -> None:
+        index = len(self.kinds)
+
+        match token.name:
+            case TagCategory.START_CHILDREN:
+                self._open.append(index)
+                self.ends.append(-1)
+            case TagCategory.END_CHILDREN if self._open:
+                start = self._open.pop()
+                self.ends[start] = index
+                self.ends.append(start)
+            case _:
+                self.ends.append(-1)
+
+        self.kinds.append(token.name)
+        self.str_vals.append(sys.intern(token.str_val))
+        self.attrs.append(self._shared_attrs(token.attrs))
+        self.node_names.append(sys.intern(token.node_name))
+        self.styles.append(token.style)
+
+    def _shared_attrs(self, attrs: dict) -> FrozenAttrs:
+        if not attrs:
+            return EMPTY_ATTRS
+
+        key = attrs_key(attrs)
+        if (shared := self._attrs_pool.get(key)) is None:
+            shared = self._attrs_pool[key] = FrozenAttrs(attrs)
+
+        return shared
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index: int) -> Token:
+        return Token(
+            CATEGORIES_BY_VALUE[self.kinds[index]],
+            self.str_vals[index],
+            self.attrs[index],
+            self.node_names[index],
+            self.styles[index],
+        )
+
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield self[index]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TokenStream):
+            return NotImplemented
+
+        return (
+            self.kinds == other.kinds
+            and self.str_vals == other.str_vals
+            and self.attrs == other.attrs
+            and self.node_names == other.node_names
+            and self.styles == other.styles
+        )
+
+    def __getstate__(self):
+        # the pool is just for building, it can be rebuilt from attrs
+        return (
+            self.kinds,
+            self.str_vals,
+            self.attrs,
+            self.node_names,
+            self.styles,
+            self.ends,
+        )
+
+    def __setstate__(self, state):
+        (
+            self.kinds,
+            self.str_vals,
+            self.attrs,
+            self.node_names,
+            self.styles,
+            self.ends,
+        ) = state
+        self._attrs_pool = {attrs_key(a): a for a in self.attrs if a}
+        self._open = []
+
+    def subtree_end(self, index: int) -> int:
+        # index of the last token belonging to the tag at index,
+        # i.e. its END_CHILDREN if it has children
+        after = index + 1
+        if after < len(self.kinds) and self.kinds[after] == TagCategory.START_CHILDREN:
+            if (end := self.ends[after]) != -1:
+                return end
+
+        return index
+
+    def top_level_spans(self):
+        # (start, stop) of every top level tag and its children, in order
+        index = 0
+        while index < len(self.kinds) and self.kinds[index] != TagCategory.EOF:
+            stop = self.subtree_end(index) + 1
+            yield index, stop
+            index = stop
+
+    def slice(self, start: int, stop: int) -> "TokenStream":
+        # a stand alone stream for [start, stop), with its own EOF
+        # only makes sense for whole subtrees, see top_level_spans
+        ends = array("i", (e - start if e != -1 else -1 for e in self.ends[start:stop]))
+
+        part = TokenStream()
+        part.__setstate__(
+            (
+                self.kinds[start:stop],
+                self.str_vals[start:stop],
+                self.attrs[start:stop],
+                self.node_names[start:stop],
+                self.styles[start:stop],
+                ends,
+            )
+        )
+        part.append(Token(TagCategory.EOF))
+        return part
+
+    def cursor(self) -> "StreamCursor":
+        return StreamCursor(self)
+
+
+class StreamCursor:
+    # same interface as TokenBuffer but over a TokenStream,
+    # check/match only ever look at the kinds array
+    def __init__(self, stream: TokenStream) -> None:
+        self.stream = stream
+        self.kinds = stream.kinds
+        self.current = 0
+        self._end = len(stream.kinds) - 1
+        self._previous = None
+
+    def peek(self) -> Token:
+        return self.stream[self.current]
+
+    def peek_kind(self) -> int:
+        return self.kinds[self.current]
+
+    def previous(self) -> Token:
+        # handlers ask for the previous token a few times, only build it once
+        if self._previous is None:
+            self._previous = self.stream[self.current - 1]
+        return self._previous
+
+    def advance(self) -> Token:
+        if self.current < self._end and self.kinds[self.current] != TagCategory.EOF:
+            self.current += 1
+            self._previous = None
+
+        return self.previous()
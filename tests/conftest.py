@@ -0,0 +1,43 @@
+import shutil
+import sys
+
+from pathlib import Path
+
+import pytest
+
+TESTS_DIR = Path(__file__).parent
+sys.path.insert(0, str(TESTS_DIR.parent))
+
+SITE_DIR = TESTS_DIR / "site"
+# relative to the site, the way build_site finds them
+SAMPLE_PAGES = sorted(
+    path.relative_to(SITE_DIR) for path in (SITE_DIR / "src_html").rglob("*.html")
+)
+
+import generate_home_content
+import generate_main
+import page_content
+
+# (profile, page) for every profile a sample page can be built with,
+# main and home need a #main
+PAGES = [
+    (profile, page)
+    for page in SAMPLE_PAGES
+    for profile in (
+        [generate_main.PROFILE, generate_home_content.PROFILE]
+        if page.name == "wizard woes.html" or page.parent.name == "no-links"
+        else []
+    )
+    + ([page_content.PROFILE] if page.name == "index.html" else [])
+]
+PAGE_IDS = [f"{profile.name}:{page}" for profile, page in PAGES]
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch) -> Path:
+    # a copy of the sample site to build in, the pages link their stylesheet
+    # relative to the site so that's where the tests run from
+    site = tmp_path / "site"
+    shutil.copytree(SITE_DIR, site)
+    monkeypatch.chdir(site)
+    return site
@@ -0,0 +1,52 @@
+import pytest
+
+from css_units import ROOT_FONT_SIZE, convert_css_value_to_godot, resolve_font_size
+
+
+@pytest.mark.parametrize(
+    "value, font_size, expected",
+    [
+        ("12px", 16, ("int", 12)),
+        ("12.6px", 16, ("int", 13)),
+        ("0", 16, ("int", 0)),
+        ("2em", 16, ("int", 32)),
+        ("1.5em", 20, ("int", 30)),
+        (".5em", 12, ("int", 6)),
+        ("2rem", 40, ("int", 2 * ROOT_FONT_SIZE)),
+        ("12pt", 16, ("int", 16)),
+        ("50%", 16, ("float", 0.5)),
+        ("auto", 16, ("str", "auto value")),
+        ("inherit", 16, ("str", "inherit")),
+    ],
+)
+def test_convert_css_value(value, font_size, expected):
+    assert convert_css_value_to_godot(value, font_size) == expected
+
+
+def test_viewport_units():
+    kind, code = convert_css_value_to_godot("50vh")
+    assert kind == "script"
+    assert code == "0.5 * get_viewport().get_visible_rect().size.y"
+
+
+@pytest.mark.parametrize(
+    "value, parent_size, expected",
+    [
+        (None, 20, 20),
+        ("18px", 20, 18),
+        ("2em", 20, 40),
+        ("150%", 20, 30),
+        ("1.5rem", 40, 1.5 * ROOT_FONT_SIZE),
+        ("12pt", 20, 16),
+        ("larger", 20, 20),
+    ],
+)
+def test_resolve_font_size(value, parent_size, expected):
+    assert resolve_font_size(value, parent_size) == pytest.approx(expected)
+
+
+def test_nested_em_compounds():
+    # 2em inside 1.5em inside the root, then a margin of 1em in that
+    size = resolve_font_size("2em", resolve_font_size("1.5em", ROOT_FONT_SIZE))
+    assert size == 48
+    assert convert_css_value_to_godot("1em", size) == ("int", 48)
@@ -0,0 +1,239 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+from pathlib import Path
+
+import pytest
+
+import build_site
+import manifest
+import page_content
+
+from artifact_cache import ArtifactCache
+from manifest import MANIFEST_NAME, PACKAGE_DIR
+from pipeline import SitePipeline
+from render_godot import write_files, write_if_changed
+
+
+def build(*args):
+    argv = ["--no-cache", "--outdir", "out", *args]
+    return build_site.main(build_site.arg_parser.parse_args(argv))
+
+
+def outputs(out: Path) -> dict[Path, int]:
+    # every file the build wrote in out, and when it was written
+    return {
+        path.relative_to(out): path.stat().st_mtime_ns
+        for path in out.rglob("*")
+        if path.is_file() and path.name != MANIFEST_NAME
+    }
+
+
+def test_write_if_changed(tmp_path):
+    path = tmp_path / "scene" / "page.tscn"
+    assert write_if_changed(path, "one")
+    assert path.read_text() == "one"
+
+    os.utime(path, ns=(0, 0))
+    assert not write_if_changed(path, "one")
+    assert path.stat().st_mtime_ns == 0
+
+    assert write_if_changed(path, "two")
+    assert path.read_text() == "two"
+    assert path.stat().st_mtime_ns != 0
+    assert os.listdir(path.parent) == ["page.tscn"]
+
+
+def test_write_files(tmp_path):
+    files = {Path("a.tscn"): "a", Path("b/b.gd"): "b"}
+    assert write_files(tmp_path, files) == {
+        tmp_path / "a.tscn": True,
+        tmp_path / "b/b.gd": True,
+    }
+
+    files[Path("a.tscn")] = "changed"
+    assert write_files(tmp_path, files) == {
+        tmp_path / "a.tscn": True,
+        tmp_path / "b/b.gd": False,
+    }
+
+
+def test_rebuild_leaves_outputs_alone(site, capsys):
+    out = site / "out"
+    assert build() == 0
+    first = outputs(out)
+    assert Path("main.tscn") in first
+    assert not any(path.suffix == ".tmp" for path in first)
+
+    # everything gets converted again, nothing comes out any different
+    assert build("--force") == 0
+    assert "0 written" in capsys.readouterr().out
+    assert outputs(out) == first
+
+
+def test_deleted_page_outputs_removed(site, capsys):
+    out = site / "out"
+    assert build() == 0
+    assert (out / "glas/page-2/page-2.tscn").is_file()
+
+    shutil.rmtree(site / "src_html/glas/page-2")
+    capsys.readouterr()
+    assert build() == 0
+
+    assert "2 removed" in capsys.readouterr().out
+    assert not (out / "glas/page-2").exists()
+    # shared with the pages that are still there
+    assert (out / "HtmlNode.gd").is_file()
+    assert (out / "glas/page-1/page-1.tscn").is_file()
+
+
+def test_changed_options_rebuild(site, capsys):
+    assert build() == 0
+    capsys.readouterr()
+
+    assert build("--css", "inline") == 0
+    assert re.search(r"converted (\d+)/\1 pages, 0 up to date", capsys.readouterr().out)
+    assert build("--css", "inline") == 0
+    assert "converted 0/0 pages" in capsys.readouterr().out
+
+
+def test_watch_keeps_going(site, monkeypatch, capsys):
+    args = build_site.arg_parser.parse_args(["--no-cache", "--outdir", "out"])
+    manifest = build_site.BuildManifest.load("out")
+    page = site / "src_html/glas/page-1/index.html"
+    builds = []
+    polls = 0
+
+    def sleep(_):
+        nonlocal polls
+        polls += 1
+        if polls == 1:
+            page.write_text(page.read_text() + "\n")
+        elif polls == 3:
+            raise KeyboardInterrupt
+
+    def run_build(*_):
+        builds.append(page.read_text())
+        if len(builds) == 1:
+            # saved again while the build runs, then the build blows up
+            page.write_text(page.read_text() + "<p>more</p>\n")
+            raise RuntimeError("broken page")
+        return 0
+
+    monkeypatch.setattr(build_site.time, "sleep", sleep)
+    monkeypatch.setattr(build_site, "run_build", run_build)
+    build_site.watch(args, manifest)
+
+    assert len(builds) == 2
+    assert builds[1].endswith("<p>more</p>\n")
+    assert "build failed, still watching" in capsys.readouterr().err
+
+
+def tree(out: Path) -> dict[Path, bytes]:
+    return {
+        path.relative_to(out): path.read_bytes()
+        for path in out.rglob("*")
+        if path.is_file() and path.name != MANIFEST_NAME
+    }
+
+
+def test_same_output_every_process(site):
+    # uids and resource ids come from the page, not from str hashing
+    # (which is salted per process) or anything else that changes between runs
+    for seed in ["1", "2"]:
+        subprocess.run(
+            [sys.executable, str(PACKAGE_DIR / "build_site.py"), "--no-cache"]
+            + ["--outdir", f"out-{seed}"],
+            env={**os.environ, "PYTHONHASHSEED": seed},
+            check=True,
+            capture_output=True,
+        )
+
+    first, second = tree(site / "out-1"), tree(site / "out-2")
+    assert first == second
+    scene = first[Path("main.tscn")].decode()
+    assert 'uid="uid://' in scene
+    assert "[ext_resource" in scene
+
+
+def converted(capsys) -> tuple[int, int]:
+    # (pages converted, pages up to date) from the build's report
+    report = capsys.readouterr().out
+    found = re.search(r"converted (\d+)/\d+ pages, (\d+) up to date", report)
+    return int(found[1]), int(found[2])
+
+
+def test_rebuilds_what_changed(site, tmp_path, monkeypatch, capsys):
+    # page-2 links a sheet of its own as well
+    extra = site / "src_html/extra.css"
+    extra.write_text("h1 { color: red; }\n")
+    page = site / "src_html/glas/page-2/index.html"
+    page.write_text(
+        page.read_text().replace(
+            "</head>", '<link rel="stylesheet" href="src_html/extra.css"></head>'
+        )
+    )
+    # a copy of the templates that can be changed
+    templates = tmp_path / "templates"
+    shutil.copytree(manifest.TEMPLATE_DIR, templates)
+    monkeypatch.setattr(manifest, "TEMPLATE_DIR", templates)
+
+    assert build() == 0
+    pages, _ = converted(capsys)
+    assert build() == 0
+    assert converted(capsys) == (0, pages)
+
+    extra.write_text("h1 { color: blue; }\n")
+    assert build() == 0
+    assert converted(capsys) == (1, pages - 1)
+
+    (site / "out/glas/page-1/page-1.tscn").unlink()
+    assert build() == 0
+    assert converted(capsys) == (1, pages - 1)
+    assert (site / "out/glas/page-1/page-1.tscn").is_file()
+
+    for changed in [site / "src_html/style.css", templates / "scene.tscn.j2"]:
+        changed.write_text(changed.read_text() + "\n")
+        assert build() == 0
+        assert converted(capsys) == (pages, 0)
+
+
+def test_cache_hits_give_the_same_output(site, capsys):
+    # a second output dir has no manifest, so every page is converted again,
+    # straight out of the cache
+    for out in ["out-1", "out-2"]:
+        args = ["--cache-dir", "cache", "--outdir", out]
+        assert build_site.main(build_site.arg_parser.parse_args(args)) == 0
+
+    first, second = capsys.readouterr().out.split("converted")[1:]
+    assert re.search(r"render 0 hit/(\d+) miss", first)
+    found = re.search(r"render (\d+) hit/0 miss", second)
+    assert found and int(found[1]) > 0
+    assert tree(site / "out-1") == tree(site / "out-2")
+
+
+def test_cache_hit_in_another_pipeline(site):
+    page = Path("src_html/glas/page-3/index.html")
+    rendered = []
+    for _ in range(2):
+        cache = ArtifactCache(site / "cache")
+        pipeline = SitePipeline(site / "out", cache=cache)
+        rendered.append(pipeline.render_page(page_content.PROFILE, page))
+
+    assert cache.hits["render"] == 1
+    assert rendered[0] == rendered[1]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_async_io_same_output(site, jobs):
+    for out, extra in [("out-sync", []), ("out-async", ["--async-io", "-j", jobs])]:
+        args = ["--no-cache", "--outdir", out, *extra]
+        assert build_site.main(build_site.arg_parser.parse_args(args)) == 0
+
+    assert tree(site / "out-sync") == tree(site / "out-async")
+    assert (site / "out-sync" / MANIFEST_NAME).read_text() == (
+        site / "out-async" / MANIFEST_NAME
+    ).read_text().replace("out-async", "out-sync")
@@ -0,0 +1,139 @@
+import pytest
+
+from pathlib import Path
+
+import page_content
+
+from bench_scanner import scan_bs4, scan_lxml, synthetic_page
+
+from pipeline import SitePipeline
+from tag_token import TagCategory
+
+from conftest import PAGE_IDS, PAGES
+
+
+def scan(site, scanner, profile, page, css="compiled"):
+    pipeline = SitePipeline(site / "out", scanner=scanner, css=css)
+    return list(pipeline.scan(profile, pipeline.inline(page), page))
+
+
+@pytest.mark.parametrize("profile, page", PAGES, ids=PAGE_IDS)
+@pytest.mark.parametrize("css", ["compiled", "inline"])
+def test_scanners_agree(site, profile, page, css):
+    tokens = scan(site, "lxml", profile, page, css)
+    assert tokens
+    assert tokens == scan(site, "bs4", profile, page, css)
+
+
+def test_lxml_too_deep(site, capsys):
+    # past 2048 levels libxml2 drops the rest of the page without failing
+    depth = 3000
+    page = site / "src_html" / "deep.html"
+    page.write_text(
+        "<html><body><div id='content'>"
+        + "<div>" * depth
+        + "<p>at the bottom</p>"
+        + "</div>" * depth
+        + "</div></body></html>"
+    )
+    tokens = scan(site, "lxml", page_content.PROFILE, page)
+    assert "nested too deep for lxml" in capsys.readouterr().err
+    assert tokens == scan(site, "bs4", page_content.PROFILE, page)
+    assert any(token.str_val == "at the bottom" for token in tokens)
+
+
+@pytest.mark.parametrize("profile, page", PAGES, ids=PAGE_IDS)
+@pytest.mark.parametrize("scanner", ["bs4", "lxml"])
+def test_css_modes_agree(site, profile, page, scanner):
+    # css_engine has to come up with the styles css_inline writes into the page,
+    # !important and all (and without the flag left on the values)
+    # (inline mode also has the style attribute css_inline wrote in attrs)
+    compiled, inline = (
+        [(t.name, t.str_val, t.node_name, t.style) for t in tokens]
+        for tokens in (
+            scan(site, scanner, profile, page, "compiled"),
+            scan(site, scanner, profile, page, "inline"),
+        )
+    )
+    assert compiled == inline
+    values = [value for *_, style in compiled for value in style.values()]
+    assert not any("important" in value for value in values)
+
+
+def test_scopes_close_in_the_right_place():
+    # the p closes before its sibling, the inner div before the outer one's p
+    html = (
+        "<html><body><div id='content'>"
+        "<div><p>a<span>b</span></p><p>c</p></div><p>d</p>"
+        "</div></body></html>"
+    )
+    tokens = scan_bs4(html)
+    assert [(t.name.name, t.str_val) for t in tokens] == [
+        ("BODY", ""), ("START_CHILDREN", "body"),
+        ("DIV", ""), ("START_CHILDREN", "div"),
+        ("DIV", ""), ("START_CHILDREN", "div"),
+        ("P", ""), ("START_CHILDREN", "p"),
+        ("TEXT", "a"), ("SPAN", "b"),
+        ("END_CHILDREN", "p"),
+        ("P", ""), ("START_CHILDREN", "p"), ("TEXT", "c"), ("END_CHILDREN", "p"),
+        ("END_CHILDREN", "div"),
+        ("P", ""), ("START_CHILDREN", "p"), ("TEXT", "d"), ("END_CHILDREN", "p"),
+        ("END_CHILDREN", "div"),
+        ("END_CHILDREN", "body"),
+        ("EOF", ""),
+    ]  # fmt: skip
+    assert tokens == scan_lxml(html)
+
+
+def test_wide_page_scopes():
+    # the shapes bench_scanner times, every scope opened is closed once
+    tokens = scan_bs4(synthetic_page(2_000))
+    assert tokens == scan_lxml(synthetic_page(2_000))
+
+    kinds = list(tokens.kinds)
+    starts = [i for i, kind in enumerate(kinds) if kind == TagCategory.START_CHILDREN]
+    assert len(starts) == kinds.count(TagCategory.END_CHILDREN)
+    assert all(tokens.ends[tokens.ends[start]] == start for start in starts)
+
+
+@pytest.mark.parametrize(
+    "markup",
+    [
+        "<h2>Hello <em>world</em></h2>",
+        "<h3><em>a</em> b</h3>",
+        "<code>a<b>b</b></code>",
+        "<h1>Title <span>and more</span></h1>",
+        "<h2></h2>",
+    ],
+)
+def test_string_tag_with_mixed_content(site, markup):
+    # no one string to take, so it's scanned as a container like the
+    # tags nobody registered
+    html = f"<html><body><div id='content'>{markup}<p>after</p></div></body></html>"
+    tokens = scan_bs4(html)
+    assert tokens == scan_lxml(html)
+    assert tokens[4].name == TagCategory.FLOW
+
+    page = site / "src_html" / "mixed.html"
+    page.write_text(html)
+    for scanner in ["bs4", "lxml"]:
+        pipeline = SitePipeline(site / "out", scanner=scanner)
+        assert pipeline.render_page(page_content.PROFILE, page)
+
+
+@pytest.mark.parametrize("scanner", ["bs4", "lxml"])
+def test_unsupported_selectors_use_css_inline(site, scanner):
+    # css_engine can't do :not() or :nth-child(), those pages get css_inline
+    page = Path("src_html/glas/selectors/index.html")
+    tokens = scan(site, scanner, page_content.PROFILE, page)
+
+    # text -> the style of the tag it's in (the token before its START_CHILDREN)
+    styles = {
+        text.str_val: tokens[i - 2].style
+        for i, text in enumerate(tokens)
+        if text.name == TagCategory.TEXT
+    }
+    assert styles["plain"]["font-size"] == "18px"
+    assert styles["note"]["font-size"] == "14px"
+    assert styles["two"] == {"color": "red"}
+    assert "color" not in styles["one"]
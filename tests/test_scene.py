@@ -0,0 +1,185 @@
+import sys
+
+from pathlib import Path
+
+import pytest
+
+import generate_home_content
+import generate_main
+import page_content
+
+from godot import NodeGodot, SceneGodot
+from node_parser import split_spans
+from pipeline import SitePipeline
+from render_godot import SceneWriter
+
+NO_LINKS = Path("src_html/glas/no-links/index.html")
+WIZARD_WOES = Path("src_html/wizard woes.html")
+
+
+@pytest.mark.parametrize(
+    "profile", [page_content.PROFILE, generate_home_content.PROFILE]
+)
+def test_page_without_links(site, profile):
+    # no links means no script on the root
+    pipeline = SitePipeline(site / "out")
+    tokens = pipeline.scan(profile, pipeline.inline(NO_LINKS), NO_LINKS)
+    root = pipeline.parse(profile, tokens)
+    assert root.script is None
+
+    scene = SceneGodot(root, path="glas/no-links/no-links")
+    assert None not in scene.ext_resources
+    assert None not in scene.scripts
+    assert scene.fd.load_steps == len(scene.ext_resources) + 1
+
+    files = pipeline.render_page(profile, NO_LINKS)
+    assert "None" not in "".join(files.values())
+
+
+def test_index_follows_attached_nodes():
+    root = NodeGodot("content", "VBoxContainer")
+    root.add_child(NodeGodot("p", "VBoxContainer"))
+    scene = SceneGodot(root, path="page")
+    assert [node.name for node in scene.flat_nodes()] == ["content", "p"]
+    assert scene.ext_resources == []
+    assert scene.fd.load_steps == 1
+
+    late = NodeGodot("p", "VBoxContainer")
+    root.add_child(late)
+    late.apply_font_family("cloister")
+
+    assert [node.name for node in scene.flat_nodes()] == ["content", "p", "p-2"]
+    assert [resource.type for resource in scene.ext_resources] == ["FontFile"]
+    assert scene.fd.load_steps == 2
+
+
+@pytest.mark.parametrize("css", ["compiled", "inline"])
+def test_inherited_font_is_one_resource(site, css):
+    # the body's font-family is inherited by every node under it, they all
+    # point at the same FontFile instead of each bringing their own
+    profile = generate_main.PROFILE
+    pipeline = SitePipeline(site / "out", css=css)
+    tokens = pipeline.scan(profile, pipeline.inline(WIZARD_WOES), WIZARD_WOES)
+    scene = SceneGodot(pipeline.parse(profile, tokens), path="main/main")
+
+    fonts = [res for res in scene.ext_resources if res.type == "FontFile"]
+    assert len(fonts) == 1
+    used = [
+        res
+        for node in scene.flat_nodes()
+        for res in node.resources or ()
+        if res.type == "FontFile"
+    ]
+    assert len(used) > 1
+    assert all(res is fonts[0] for res in used)
+    assert scene.fd.load_steps == len(scene.ext_resources) + 1
+
+
+def test_build_is_quiet(site, capsys):
+    # nothing but the report on stdout, page-3 has tags without class options
+    pipeline = SitePipeline(site / "out")
+    pipeline.render_page(page_content.PROFILE, Path("src_html/glas/page-3/index.html"))
+    assert capsys.readouterr().out == ""
+
+
+@pytest.mark.parametrize("scanner", ["bs4", "lxml"])
+def test_very_deep_page(site, scanner):
+    # nothing on the way from html to scene recurses per level of nesting,
+    # so a page nested far deeper than the recursion limit still converts
+    depth = 10_000
+    assert sys.getrecursionlimit() < depth
+    page = site / "src_html" / "deep.html"
+    page.write_text(
+        "<html><body><div id='content'>"
+        + "<div>" * depth
+        + "<p>at the bottom</p>"
+        + "</div>" * depth
+        + "</div></body></html>"
+    )
+
+    pipeline = SitePipeline(site / "out", scanner=scanner)
+    tokens = pipeline.scan(page_content.PROFILE, pipeline.inline(page), page)
+    root = pipeline.parse(page_content.PROFILE, tokens)
+    scene = SceneGodot(root, path="deep/deep")
+
+    nodes = scene.flat_nodes()
+    assert len(nodes) > depth
+    assert nodes[-1].parent_path_str.count("/") >= depth
+    assert "at the bottom" in SceneWriter(scene, "out").render_scene()
+
+
+def test_sibling_names():
+    root = NodeGodot("content", "VBoxContainer")
+    for name in ["p", "p", "p-3", "p", "div", "p"]:
+        root.add_child(NodeGodot(name, "VBoxContainer"))
+
+    # repeats count up, skipping the name a child brought along
+    names = [child.name for child in root._children]
+    assert names == ["p", "p-2", "p-3", "p-4", "div", "p-5"]
+
+    # only siblings clash
+    child = root._children[0]
+    child.add_child(NodeGodot("p", "VBoxContainer"))
+    assert child._children[0].name == "p"
+
+
+def test_sibling_names_every_build(site):
+    # the same page has to come out with the same names every time
+    profile = page_content.PROFILE
+    page = Path("src_html/glas/page-3/index.html")
+    builds = []
+    for _ in range(2):
+        pipeline = SitePipeline(site / "out")
+        tokens = pipeline.scan(profile, pipeline.inline(page), page)
+        scene = SceneGodot(pipeline.parse(profile, tokens), path="page-3")
+        builds.append([node.node_path for node in scene.flat_nodes()])
+
+    assert builds[0] == builds[1]
+    assert len(set(builds[0])) == len(builds[0])
+
+
+def test_node_path_after_move_and_rename():
+    root = NodeGodot("content", "VBoxContainer")
+    a, b, c, d = (NodeGodot(name, "VBoxContainer") for name in "abcd")
+    root.add_child(a)
+    a.add_child(b)
+    b.add_child(c)
+    root.add_child(d)
+    assert (b.node_path, c.node_path, c.parent_path_str) == ("a/b", "a/b/c", "a/b")
+
+    # moved under d, everything under b moves with it
+    d.add_child(b)
+    assert (b.node_path, c.node_path, c.parent_path_str) == ("d/b", "d/b/c", "d/b")
+
+    b.name = "renamed"
+    b.forget_node_path()
+    assert c.node_path == "d/renamed/c"
+    assert c.parent_path_str == "d/renamed"
+    assert d.node_path == "d"
+
+
+@pytest.mark.parametrize("parse_jobs", [2, 3])
+def test_parallel_parse_same_scene(site, parse_jobs):
+    # sections with links (root script functions), repeated names and styles
+    # spread over the runs the workers get
+    sections = "".join(
+        f"<div class='section'><h1>part {i}</h1><p style='font-size: 2em'>text</p>"
+        f"<a href='/glas/page-{i % 3 + 1}/'>next</a></div><p>between</p>"
+        for i in range(12)
+    )
+    page = site / "src_html" / "sections.html"
+    page.write_text(f"<html><body><div id='content'>{sections}</div></body></html>")
+    profile = page_content.PROFILE
+
+    scenes = []
+    for jobs in [1, parse_jobs]:
+        pipeline = SitePipeline(site / "out", parse_jobs=jobs)
+        try:
+            tokens = pipeline.scan(profile, pipeline.inline(page), page)
+            assert len(split_spans(tokens, jobs)) == jobs
+            scene = SceneGodot(pipeline.parse(profile, tokens), path="sections")
+            scenes.append(SceneWriter(scene, "out").rendered_files())
+        finally:
+            pipeline.close()
+
+    assert scenes[0] == scenes[1]
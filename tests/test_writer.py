@@ -0,0 +1,99 @@
+import itertools
+import os
+
+from pathlib import Path
+
+import pytest
+
+import page_content
+
+from godot import GDScriptResource, Label, NodeGodot, SceneGodot, ScriptFunction
+from pipeline import SitePipeline
+from render_godot import SceneWriter
+
+from conftest import PAGE_IDS, PAGES
+
+
+def assert_same_both_ways(scene: SceneGodot):
+    # write_scene has to give exactly what templates/scene.tscn.j2 does
+    native = SceneWriter(scene, "out").render_scene()
+    template = SceneWriter(scene, "out", jinja=True).render_scene()
+    assert native == template
+
+
+@pytest.mark.parametrize("profile, page", PAGES, ids=PAGE_IDS)
+@pytest.mark.parametrize("css", ["compiled", "inline"])
+def test_sample_pages(site, profile, page, css):
+    pipeline = SitePipeline(site / "out", css=css)
+    tokens = pipeline.scan(profile, pipeline.inline(page), page)
+    root = pipeline.parse(profile, tokens)
+    out_dir, out_fname = profile.output(page)
+
+    assert_same_both_ways(SceneGodot(root, path=(out_dir / out_fname).as_posix()))
+
+
+@pytest.mark.parametrize(
+    "properties, theme, resources, script",
+    list(itertools.product([False, True], [False, True], [0, 1, 2], [False, True])),
+)
+def test_every_kind_of_node(properties, theme, resources, script):
+    root = NodeGodot("content", "VBoxContainer")
+    parent = root
+    # one right under the root, one a level further down
+    for _ in range(2):
+        node = Label("text")
+        if properties:
+            node.properties.update({"visible": True, "text": "hi", "scale": 1.5})
+        if theme:
+            node.apply_font_size(12)
+            node.set_theme_property("margin_top", None)
+            node.set_theme_property("not_an_override", 1)
+        for _ in range(resources):
+            node.apply_font_family("cloister")
+        if script:
+            gd = GDScriptResource(source="Label")
+            gd.add_function(ScriptFunction("_ready", ["pass"]))
+            node.add_script(gd)
+
+        parent.add_child(node)
+        parent = node
+
+    if script:
+        root.add_script(GDScriptResource(source="VBoxContainer"))
+
+    assert_same_both_ways(SceneGodot(root, path="glas/page/page"))
+
+
+@pytest.mark.parametrize("jinja", [False, True])
+def test_rendered_files_without_links(site, jinja):
+    # nothing for the root to have a script for
+    page = site / "src_html/glas/no-links/index.html"
+    files = SitePipeline(site / "out", jinja=jinja).render_page(
+        page_content.PROFILE, page
+    )
+    assert list(files) == [Path("no-links.tscn")]
+
+
+@pytest.mark.parametrize("jinja", [False, True])
+def test_write_out_scene(site, jinja):
+    profile = page_content.PROFILE
+    page = Path("src_html/glas/page-3/index.html")
+    pipeline = SitePipeline(site / "out")
+    root = pipeline.parse(profile, pipeline.scan(profile, pipeline.inline(page), page))
+    writer = SceneWriter(
+        SceneGodot(root, path="glas/page-3/page-3"), site / "out", "page-3", jinja
+    )
+
+    outfile = writer.write_out_scene()
+    assert outfile.read_text() == writer.rendered_files()[Path("page-3.tscn")]
+
+    # the same scene again leaves the file alone
+    os.utime(outfile, ns=(0, 0))
+    writer.write_out_scene()
+    assert outfile.stat().st_mtime_ns == 0
+    assert os.listdir(outfile.parent) == ["page-3.tscn"]
+
+    writer.scene.nodes.add_child(NodeGodot("late", "VBoxContainer"))
+    writer.write_out_scene()
+    assert outfile.stat().st_mtime_ns != 0
+    assert outfile.read_text() == writer.rendered_files()[Path("page-3.tscn")]